@@ -17,9 +17,10 @@
 
 import copy
 import multiprocessing
+import os
 import pathlib
 import sys
-from typing import Iterator, List, Tuple
+from typing import Iterator, List, Optional, Set, Tuple
 
 from absl import app, flags, logging
 
@@ -29,6 +30,10 @@ from aerleon.utils import config
 FLAGS = flags.FLAGS
 WriteList = List[Tuple[pathlib.Path, str]]
 
+# Policy source file suffixes, and those handled by the YAML front end.
+_YAML_SUFFIXES = frozenset({'.yaml', '.yml'})
+_POLICY_SUFFIXES = _YAML_SUFFIXES | {'.pol'}
+
 
 def SetupFlags():
     """Read in configuration from CLI flags."""
@@ -197,7 +202,7 @@ def RenderFile(
 
     try:
         # PolicySource[extension].ParsePolicy(conf)
-        if pathlib.Path(input_file).suffix == '.yaml' or pathlib.Path(input_file).suffix == '.yml':
+        if input_file.suffix in _YAML_SUFFIXES:
             pol = yaml.ParsePolicy(
                 conf,
                 filename=input_file,
@@ -340,9 +345,7 @@ def DescendDirectory(input_dirname: str, ignore_directories: List[str]) -> List[
     input_dir = pathlib.Path(input_dirname)
 
     policy_files: List[pathlib.Path] = []
-    policy_directories: Iterator[pathlib.Path] = filter(
-        lambda path: path.is_dir(), input_dir.glob('**/pol')
-    )
+    policy_directories: Iterator[pathlib.Path] = _PolicyDirectories(input_dir)
     for ignored_directory in ignore_directories:
 
         def Filtering(path, ignored=ignored_directory):
@@ -351,13 +354,10 @@ def DescendDirectory(input_dirname: str, ignore_directories: List[str]) -> List[
         policy_directories = filter(Filtering, policy_directories)
 
     for directory in policy_directories:
-        # Build glob strings from PolicySources.keys()
-        # Or just match by extension
-        directory_policies = (
-            list(directory.glob('*.pol'))
-            + list(directory.glob('*.yaml'))
-            + list(directory.glob('*.yml'))
-        )
+        # Match by extension in a single listing of the directory
+        directory_policies = [
+            path for path in directory.iterdir() if path.suffix in _POLICY_SUFFIXES
+        ]
         depth = len(directory.parents) - 1
         logging.warning(
             '-' * (2 * depth) + '> %s (%d pol files found)' % (directory, len(directory_policies))
@@ -367,6 +367,23 @@ def DescendDirectory(input_dirname: str, ignore_directories: List[str]) -> List[
     return policy_files
 
 
+def _PolicyDirectories(input_dir: pathlib.Path) -> Iterator[pathlib.Path]:
+    """Yield each directory named pol under input_dir.
+
+    The tree is walked with os.walk, which is backed by os.scandir, so a Path is
+    only built for the pol directories themselves.
+
+    Args:
+      input_dir: the base directory.
+
+    Yields:
+      pol directory paths, parents before children.
+    """
+    for dirpath, dirnames, _ in os.walk(input_dir):
+        if 'pol' in dirnames:
+            yield pathlib.Path(dirpath, 'pol')
+
+
 def WriteFiles(write_files: WriteList):
     """Writes files to disk.
 
@@ -377,21 +394,32 @@ def WriteFiles(write_files: WriteList):
         logging.info('writing %d files to disk...', len(write_files))
     else:
         logging.info('no files changed, not writing to disk')
+    output_dirs: Set[pathlib.Path] = set()
     for output_file, file_contents in write_files:
-        _WriteFile(output_file, file_contents)
+        _WriteFile(output_file, file_contents, output_dirs)
 
 
-def _WriteFile(output_file: pathlib.Path, file_contents: str):
+def _WriteFile(
+    output_file: pathlib.Path,
+    file_contents: str,
+    output_dirs: Optional[Set[pathlib.Path]] = None,
+):
     """Inner file writing function.
 
     Args:
       output_file: Path to write to
       file_contents: Data to write
+      output_dirs: Directories already known to exist. The parent directory of
+        output_file is added once it exists, so that files sharing a directory
+        only check it once.
     """
     try:
         parent_path = pathlib.Path(output_file).parent
-        if not parent_path.is_dir():
-            parent_path.mkdir(parents=True, exist_ok=True)
+        if output_dirs is None or parent_path not in output_dirs:
+            if not parent_path.is_dir():
+                parent_path.mkdir(parents=True, exist_ok=True)
+            if output_dirs is not None:
+                output_dirs.add(parent_path)
         with open(output_file, 'w') as output:
             logging.info('writing file: %s', output_file)
             output.write(file_contents)
@@ -0,0 +1 @@
+"""Generated PLY parser tables for Aerleon. Do not edit by hand."""
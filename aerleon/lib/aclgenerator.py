@@ -409,7 +409,7 @@ class ACLGenerator:
                 'reject',
                 'reject-with-tcp-rst',
             },
-            'icmp_type': set(list(Term.ICMP_TYPE[4].keys()) + list(Term.ICMP_TYPE[6].keys())),
+            'icmp_type': set(policy.ICMP_TYPE_NAMES),
         }
         return supported_tokens, supported_sub_tokens
 
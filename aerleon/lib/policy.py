@@ -18,14 +18,19 @@
 
 from __future__ import annotations
 
+import bisect
+import copy
 import datetime
+import functools
 import os
 import pathlib
+import pickle
+import re
 import sys
-from typing import TYPE_CHECKING, Any, List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from absl import logging
-from ply import lex, yacc
+from ply import yacc
 from ply.lex import LexToken
 from ply.yacc import YaccProduction
 
@@ -37,23 +42,43 @@ if TYPE_CHECKING:
 
 DEFINITIONS = None
 DEFAULT_DEFINITIONS = './def'
-ACTIONS = set(('accept', 'count', 'deny', 'reject', 'next', 'reject-with-tcp-rst'))
-PROTOS_WITH_PORTS = frozenset(('tcp', 'udp', 'udplite', 'sctp'))
-FLEXIBLE_MATCH_RANGE_ATTRIBUTES = {
-    'byte-offset',
-    'bit-offset',
-    'bit-length',
-    'match-start',
-    'range',
-    'range-except',
-    'flexible-range-name',
-}
-FLEXIBLE_MATCH_START_OPTIONS = {'layer-3', 'layer-4', 'payload'}
-_LOGGING = set(('true', 'True', 'syslog', 'local', 'disable', 'log-both'))
+ACTIONS = frozenset(
+    map(sys.intern, ('accept', 'count', 'deny', 'reject', 'next', 'reject-with-tcp-rst'))
+)
+PROTOS_WITH_PORTS = frozenset(map(sys.intern, ('tcp', 'udp', 'udplite', 'sctp')))
+FLEXIBLE_MATCH_RANGE_ATTRIBUTES = frozenset(
+    map(
+        sys.intern,
+        (
+            'byte-offset',
+            'bit-offset',
+            'bit-length',
+            'match-start',
+            'range',
+            'range-except',
+            'flexible-range-name',
+        ),
+    )
+)
+FLEXIBLE_MATCH_START_OPTIONS = frozenset(map(sys.intern, ('layer-3', 'layer-4', 'payload')))
+_LOGGING = frozenset(map(sys.intern, ('true', 'True', 'syslog', 'local', 'disable', 'log-both')))
 _OPTIMIZE = True
 _SHADE_CHECK = False
 _MAX_TTL = 255
 _MIN_TTL = 0
+# Pre-generated LALR tables shipped with the package. Regenerate them with
+# `nox -s parser_tables` whenever the grammar below changes.
+_PARSER_TABLES = os.path.join(os.path.dirname(__file__), '_parser_tables', 'policy.pickle')
+# Port ranges resolved by TranslatePorts, keyed by (service, protocol). Only
+# valid for the DEFINITIONS object they were resolved against.
+_PORT_CACHE = {}
+_PORT_CACHE_DEFINITIONS = None
+# Addresses resolved for terms, keyed by network token. Only set while
+# ParsePolicy or FromBuilder is building a policy.
+_NET_ADDR_CACHE = None
+# Address and port lists shorter than this are checked for containment
+# pairwise, longer ones are converted to sorted integer ranges first.
+_LINEAR_CONTAINMENT_MAX = 4
 
 
 class Error(Exception):
@@ -144,8 +169,25 @@ class InvalidNumericProtoValue(Error):
     """Error when protocols are numeric and not between -1 and 255."""
 
 
+def _Intern(value: Any) -> Any:
+    """Intern strings drawn from small vocabularies such as protocol names.
+
+    Args:
+      value: a term value, usually a string but possibly an int.
+
+    Returns:
+      the interned string, or value unchanged if it is not a string.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
 def TranslatePorts(
-    ports: List[str], protocols: List[str], term_name: str
+    ports: List[str],
+    protocols: List[str],
+    term_name: str,
+    undefined: Optional[Dict[Tuple[str, str, str], None]] = None,
 ) -> List[Tuple[int, int]]:
     """Return all ports of all protocols requested.
 
@@ -153,6 +195,9 @@ def TranslatePorts(
       ports: list of ports, eg ['SMTP', 'DNS', 'HIGH_PORTS']
       protocols: list of protocols, eg ['tcp', 'udp']
       term_name: name of current term, used for warning messages
+      undefined: optional dict collecting (term_name, port, proto) keys for
+        services not defined with a protocol. When given, warning about them is
+        left to the caller, see _WarnUndefinedServices.
 
     Returns:
       ret_array: list of ports tuples such as [(25,25), (53,53), (1024,65535)]
@@ -163,30 +208,235 @@ def TranslatePorts(
     ret_array = []
     for proto in protocols:
         for port in ports:
-            service_by_proto = DEFINITIONS.GetServiceByProto(port, proto)
-            if not service_by_proto:
-                logging.warning(
-                    'Term %s has service %s which is not defined with '
-                    'protocol %s, but will be permitted. Unless intended'
-                    ', you should consider splitting the protocols '
-                    'into separate terms!',
-                    term_name,
-                    port,
-                    proto,
-                )
-
-            for p in [x.split('-') for x in service_by_proto]:
-                if len(p) == 1:
-                    ret_array.append((int(p[0]), int(p[0])))
+            service_ports = _ResolveServicePorts(port, proto)
+            if not service_ports:
+                if undefined is None:
+                    _WarnUndefinedServices({(term_name, port, proto): None})
                 else:
-                    ret_array.append((int(p[0]), int(p[1])))
+                    undefined[(term_name, port, proto)] = None
+            ret_array.extend(service_ports)
     return ret_array
 
 
+def _WarnUndefinedServices(undefined: Dict[Tuple[str, str, str], None]) -> None:
+    """Warn once about each service not defined with a protocol of its term.
+
+    Args:
+      undefined: dict with (term_name, port, proto) keys, in the order found.
+    """
+    for term_name, port, proto in undefined:
+        logging.warning(
+            'Term %s has service %s which is not defined with '
+            'protocol %s, but will be permitted. Unless intended'
+            ', you should consider splitting the protocols '
+            'into separate terms!',
+            term_name,
+            port,
+            proto,
+        )
+
+
+def _ResolveServicePorts(port: str, proto: str) -> Tuple[Tuple[int, int], ...]:
+    """Return the port ranges of a service for a protocol, memoized per parse.
+
+    Args:
+      port: name of a service, eg 'SMTP'
+      proto: name of a protocol, eg 'tcp'
+
+    Returns:
+      tuple of port range tuples such as ((25, 25),)
+    """
+    global _PORT_CACHE_DEFINITIONS
+    if _PORT_CACHE_DEFINITIONS is not DEFINITIONS:
+        _PORT_CACHE.clear()
+        _PORT_CACHE_DEFINITIONS = DEFINITIONS
+    key = (port, proto)
+    if key not in _PORT_CACHE:
+        _PORT_CACHE[key] = tuple(
+            _ParsePortRange(x) for x in DEFINITIONS.GetServiceByProto(port, proto)
+        )
+    return _PORT_CACHE[key]
+
+
+@functools.lru_cache(maxsize=None)
+def _ParsePortRange(value: str) -> Tuple[int, int]:
+    """Parse a port or port range from the service definitions.
+
+    Unlike the per-parse service cache, this holds across parses, since the
+    same port strings recur in every policy rendered with the same definitions.
+
+    Args:
+      value: string that looks like '1024-65535' or just '25'
+
+    Returns:
+      tuple of the lowest and highest port, eg (25, 25)
+    """
+    ports = _ParseRange(value)
+    return (ports[0], ports[1] if len(ports) > 1 else ports[0])
+
+
+def _SortedEqual(left: List[Any], right: List[Any]) -> bool:
+    """Compare two term attribute lists regardless of order.
+
+    Lists of different lengths, lists that are already equal, and lists of a
+    single value are decided without sorting either of them.
+
+    Args:
+      left: list of values
+      right: list of values
+
+    Returns:
+      True if the lists hold the same values, False otherwise.
+    """
+    if len(left) != len(right):
+        return False
+    if left == right:
+        return True
+    return len(left) > 1 and sorted(left) == sorted(right)
+
+
+def _RangeIndex(ranges: Iterable[Tuple[int, int]]) -> Tuple[List[int], List[int]]:
+    """Index (first, last) ranges for containment checks.
+
+    Ranges are sorted by their first value, and each one carries the highest
+    last value seen so far, so a range is contained in the index when that
+    running maximum at its first value reaches its last value.
+
+    Args:
+      ranges: iterable of (first, last) integer tuples
+
+    Returns:
+      tuple of the sorted first values and the running maximum of last values.
+    """
+    firsts = []
+    lasts = []
+    for first, last in sorted(ranges):
+        firsts.append(first)
+        lasts.append(max(last, lasts[-1]) if lasts else last)
+    return firsts, lasts
+
+
+def _RangeIndexContains(index: Tuple[List[int], List[int]], first: int, last: int) -> bool:
+    """Return True if the range first-last lies within a range of the index.
+
+    Args:
+      index: tuple returned by _RangeIndex
+      first: first value of the range to look up
+      last: last value of the range to look up
+    """
+    firsts, lasts = index
+    position = bisect.bisect_right(firsts, first) - 1
+    return position >= 0 and lasts[position] >= last
+
+
+@functools.lru_cache(maxsize=None)
+def _ParseRange(value: str) -> Tuple[int, ...]:
+    """Parse a range attribute such as fragment-offset into integers.
+
+    Args:
+      value: string that looks like 'integer-integer' or just 'integer'
+
+    Returns:
+      tuple of the integers in value, eg (0, 5)
+    """
+    return tuple(int(x) for x in value.split('-'))
+
+
+def _ExcludeByFamily(
+    includes: List[Union[IPv4, IPv6]], excludes: List[Union[IPv4, IPv6]]
+) -> List[Union[IPv4, IPv6]]:
+    """Remove excludes from includes one address family at a time.
+
+    Families without excludes skip the exclusion entirely, and the families
+    never have to be compared against each other.
+
+    Args:
+      includes: list of nacaddr.IPv4 and nacaddr.IPv6 objects
+      excludes: list of nacaddr.IPv4 and nacaddr.IPv6 objects
+
+    Returns:
+      sorted list of the remaining addresses, IPv4 before IPv6.
+    """
+    result = []
+    for version in (4, 6):
+        family = [x for x in includes if x.version == version]
+        if not family:
+            continue
+        family_excludes = [x for x in excludes if x.version == version]
+        if family_excludes:
+            result.extend(
+                nacaddr.AddressListExclude(family, family_excludes, collapse_addrs=False)
+            )
+        else:
+            result.extend(sorted(set(family)))
+    return result
+
+
+def _DedupAddresses(addresses: List[Union[IPv4, IPv6]]) -> List[Union[IPv4, IPv6]]:
+    """Drop repeated addresses, keeping the first of each.
+
+    Only addresses that also carry the same token, parent token and comment
+    count as repeats, so nothing later collapsing relies on is lost.
+
+    Args:
+      addresses: list of nacaddr.IPv4 and nacaddr.IPv6 objects
+
+    Returns:
+      list of the distinct addresses, in their original order.
+    """
+    seen = set()
+    ret = []
+    for addr in addresses:
+        key = (
+            addr,
+            getattr(addr, 'token', None),
+            getattr(addr, 'parent_token', None),
+            getattr(addr, 'text', None),
+        )
+        if key not in seen:
+            seen.add(key)
+            ret.append(addr)
+    return ret
+
+
+def _ResolveNetAddr(token: str) -> List[Union[IPv4, IPv6]]:
+    """Return the addresses of a network token, memoized while parsing.
+
+    Callers get their own copies, since terms and generators modify address
+    objects in place.
+
+    Args:
+      token: name of a network, eg 'RFC1918'
+
+    Returns:
+      list of nacaddr.IPv4 and nacaddr.IPv6 objects
+    """
+    if _NET_ADDR_CACHE is None:
+        return DEFINITIONS.GetNetAddr(token)
+    if token not in _NET_ADDR_CACHE:
+        _NET_ADDR_CACHE[token] = DEFINITIONS.GetNetAddr(token)
+    return copy.deepcopy(_NET_ADDR_CACHE[token])
+
+
+def _SetDefinitions(definitions: Optional[naming.Naming]) -> None:
+    """Set the naming definitions used for parsing and drop cached lookups.
+
+    Args:
+      definitions: naming library definitions object, or None for the default.
+    """
+    if definitions:
+        globals()['DEFINITIONS'] = definitions
+    else:
+        globals()['DEFINITIONS'] = naming.Naming(DEFAULT_DEFINITIONS)
+    _PORT_CACHE.clear()
+
+
 # classes for storing the object types in the policy files.
 class Policy:
     """The policy object contains everything found in a given policy file."""
 
+    __slots__ = ('filters', 'filename')
+
     def __init__(self, header: Header, terms: Optional[List[Term]]) -> None:
         """Initiator for the Policy object.
 
@@ -216,36 +466,56 @@ class Policy:
         """."""
         if not terms:
             raise NoTermsError('no terms found')
-        for term in terms:
-            # TODO(pmoody): this probably belongs in Term.SanityCheck(),
-            # or at the very least, in some method under class Term()
-            if term.translated:
-                continue
-            if term.port:
-                term.port = TranslatePorts(term.port, term.protocol, term.name)
-                if not term.port:
-                    raise TermPortProtocolError(
-                        'no ports of the correct protocol for term %s' % (term.name)
-                    )
-            if term.source_port:
-                term.source_port = TranslatePorts(term.source_port, term.protocol, term.name)
-                if not term.source_port:
-                    raise TermPortProtocolError(
-                        'no source ports of the correct protocol for term %s' % (term.name)
-                    )
-            if term.destination_port:
-                term.destination_port = TranslatePorts(
-                    term.destination_port, term.protocol, term.name
+        # Services missing for a protocol are warned about once per term after
+        # translation, rather than for every port list they appear in.
+        undefined = {}
+        try:
+            for term in terms:
+                self._TranslateTerm(term, undefined)
+        finally:
+            _WarnUndefinedServices(undefined)
+
+    def _TranslateTerm(self, term: Term, undefined: Dict[Tuple[str, str, str], None]) -> None:
+        """Translate the ports of a term and clean up its addresses.
+
+        Args:
+          term: Term object to translate.
+          undefined: dict collecting services not defined with a protocol.
+
+        Raises:
+          TermPortProtocolError: if no port of the term matches its protocols.
+        """
+        # TODO(pmoody): this probably belongs in Term.SanityCheck(),
+        # or at the very least, in some method under class Term()
+        if term.translated:
+            return
+        if term.port:
+            term.port = TranslatePorts(term.port, term.protocol, term.name, undefined)
+            if not term.port:
+                raise TermPortProtocolError(
+                    'no ports of the correct protocol for term %s' % (term.name)
+                )
+        if term.source_port:
+            term.source_port = TranslatePorts(
+                term.source_port, term.protocol, term.name, undefined
+            )
+            if not term.source_port:
+                raise TermPortProtocolError(
+                    'no source ports of the correct protocol for term %s' % (term.name)
+                )
+        if term.destination_port:
+            term.destination_port = TranslatePorts(
+                term.destination_port, term.protocol, term.name, undefined
+            )
+            if not term.destination_port:
+                raise TermPortProtocolError(
+                    'no destination ports of the correct protocol for term %s' % (term.name)
                 )
-                if not term.destination_port:
-                    raise TermPortProtocolError(
-                        'no destination ports of the correct protocol for term %s' % (term.name)
-                    )
 
-            # If argument is true, we optimize, otherwise just sort addresses
-            term.AddressCleanup(_OPTIMIZE, self._NeedsAddressBook())
-            term.SanityCheck()
-            term.translated = True
+        # If argument is true, we optimize, otherwise just sort addresses
+        term.AddressCleanup(_OPTIMIZE, self._NeedsAddressBook())
+        term.SanityCheck()
+        term.translated = True
 
     def _NeedsAddressBook(self) -> bool:
         """Returns True if the policy uses a generator needing an addressbook."""
@@ -279,12 +549,15 @@ class Policy:
         Args:
           terms: list of Term objects.
         """
+        # Terms with next as an action do not terminate evaluation, so cannot
+        # shade. The action is looked up once per term; containment is still
+        # tested first, since it flattens the terms it compares.
+        terminating = ['next' not in term.action for term in terms]
         for index, term in enumerate(terms):
             for prior_index in range(index):
-                # Check each term that came before for shading. Terms with next as an
-                # action do not terminate evaluation, so cannot shade.
-                if term in terms[prior_index] and 'next' not in terms[prior_index].action:
-                    logging.warning(f"{term.name} is shaded by {terms[prior_index].name}")
+                # Check each term that came before for shading.
+                if term in terms[prior_index] and terminating[prior_index]:
+                    logging.warning('%s is shaded by %s', term.name, terms[prior_index].name)
 
     def __eq__(self, obj: Policy) -> bool:
         """Compares for equality against another Policy object.
@@ -421,6 +694,62 @@ class Term:
     }
     _IPV4_BYTE_SIZE = 1
     _IPV6_BYTE_SIZE = 4
+    # attributes compared by __eq__, either as is or regardless of order.
+    _EQ_EXACT_ATTRIBUTES = (
+        'qos',
+        'verbatim',
+        'policer',
+        'source_interface',
+        'destination_interface',
+        'ttl',
+        'log_limit',
+        'packet_length',
+        'fragment_offset',
+        'hop_limit',
+        'vpn',
+        'timeout',
+        'precedence',
+        'filter_term',
+        'next_ip',
+        'encapsulate',
+        'flexible_match_range',
+        'port_mirror',
+    )
+    _EQ_UNORDERED_ATTRIBUTES = (
+        'address',
+        'source_address',
+        'source_address_exclude',
+        'destination_address',
+        'destination_address_exclude',
+        'source_prefix',
+        'source_prefix_except',
+        'destination_prefix',
+        'destination_prefix_except',
+        'port',
+        'source_port',
+        'destination_port',
+        'logging',
+    )
+    # attributes where repeated values carry no meaning, compared as sets.
+    _EQ_SET_ATTRIBUTES = (
+        'action',
+        'protocol',
+        'protocol_except',
+        'option',
+        'pan_application',
+        'source_tag',
+        'destination_tag',
+        'icmp_type',
+        'icmp_code',
+        'ether_type',
+        'traffic_type',
+        'platform',
+        'platform_exclude',
+        'forwarding_class',
+        'forwarding_class_except',
+        'source_zone',
+        'destination_zone',
+    )
 
     def __init__(self, obj: Union[VarType, List[VarType]]) -> None:
         self.name = None
@@ -510,10 +839,16 @@ class Term:
     def __contains__(self, other: Term) -> bool:
         """Determine if other term is contained in this term."""
         if self.verbatim or other.verbatim:
-            # short circuit these
-            if sorted(list(self.verbatim)) != sorted(other.verbatim):
+            # short circuit these, sorting only lists of equal length.
+            if len(self.verbatim) != len(other.verbatim):
+                return False
+            if sorted(self.verbatim) != sorted(other.verbatim):
                 return False
 
+        # cheap discriminators run first; addresses are compared last, since
+        # most pairs seen while checking for shading are not contained and exit
+        # early.
+
         # check protocols
         # either protocol or protocol-except may be used, not both at the same time.
         if self.protocol:
@@ -532,58 +867,20 @@ class Term:
                 if not self.CheckProtocolIsContained(self.protocol_except, other.protocol_except):
                     return False
             elif other.protocol:
-                for proto in other.protocol:
-                    if proto in self.protocol_except:
-                        return False
+                if not set(self.protocol_except).isdisjoint(other.protocol):
+                    return False
             else:
                 return False
 
         # combine addresses with exclusions for proper contains comparisons.
+        # Flattening rewrites the address lists in place, so it stays right
+        # after the protocol checks: every term that gets this far is flattened,
+        # whether or not a later check rejects it.
         if not self.flattened:
             self.FlattenAll()
         if not other.flattened:
             other.FlattenAll()
 
-        # flat 'address' is compared against other flat (saddr|daddr).
-        # if NONE of these evaluate to True other is not contained.
-        if not (
-            self.CheckAddressIsContained(self.flattened_addr, other.flattened_addr)
-            or self.CheckAddressIsContained(self.flattened_addr, other.flattened_saddr)
-            or self.CheckAddressIsContained(self.flattened_addr, other.flattened_daddr)
-        ):
-            return False
-
-        # compare flat address from other to flattened self (saddr|daddr).
-        if not (
-            # other's flat address needs both self saddr & daddr to contain in order
-            # for the term to be contained. We already compared the flattened_addr
-            # attributes of both above, which was not contained.
-            self.CheckAddressIsContained(other.flattened_addr, self.flattened_saddr)
-            and self.CheckAddressIsContained(other.flattened_addr, self.flattened_daddr)
-        ):
-            return False
-
-        # basic saddr/daddr check.
-        if not (self.CheckAddressIsContained(self.flattened_saddr, other.flattened_saddr)):
-            return False
-        if not (self.CheckAddressIsContained(self.flattened_daddr, other.flattened_daddr)):
-            return False
-
-        # check ports
-        # like the address directive, the port directive is special in that it can
-        # be either source or destination.
-        if self.port:
-            if not (
-                self.CheckPortIsContained(self.port, other.port)
-                or self.CheckPortIsContained(self.port, other.source_port)
-                or self.CheckPortIsContained(self.port, other.destination_port)
-            ):
-                return False
-        if not self.CheckPortIsContained(self.source_port, other.source_port):
-            return False
-        if not self.CheckPortIsContained(self.destination_port, other.destination_port):
-            return False
-
         # prefix lists
         if self.source_prefix:
             if sorted(self.source_prefix) != sorted(other.source_prefix):
@@ -609,34 +906,30 @@ class Term:
         if self.precedence:
             if not other.precedence:
                 return False
-            for precedence in other.precedence:
-                if precedence not in self.precedence:
-                    return False
+            if not set(other.precedence).issubset(self.precedence):
+                return False
         elif other.precedence:
             return False
         # check various options
         if self.option:
             if not other.option:
                 return False
-            for opt in other.option:
-                if opt not in self.option:
-                    return False
+            if not set(other.option).issubset(self.option):
+                return False
         elif other.option:
             return False
         # check forwarding-class
         if self.forwarding_class:
             if not other.forwarding_class:
                 return False
-            for fc in other.forwarding_class:
-                if fc not in self.forwarding_class:
-                    return False
+            if not set(other.forwarding_class).issubset(self.forwarding_class):
+                return False
         # check forwarding-class-except
         if self.forwarding_class_except:
             if not other.forwarding_class_except:
                 return False
-            for fc in other.forwarding_class_except:
-                if fc not in self.forwarding_class_except:
-                    return False
+            if not set(other.forwarding_class_except).issubset(self.forwarding_class_except):
+                return False
         if self.next_ip:
             if not other.next_ip:
                 return False
@@ -645,18 +938,18 @@ class Term:
                 return False
         if self.fragment_offset:
             # fragment_offset looks like 'integer-integer' or just, 'integer'
-            sfo = sorted([int(x) for x in self.fragment_offset.split('-')])
+            sfo = sorted(_ParseRange(self.fragment_offset))
             if other.fragment_offset:
-                ofo = sorted([int(x) for x in other.fragment_offset.split('-')])
+                ofo = sorted(_ParseRange(other.fragment_offset))
                 if ofo[0] < sfo[0] or sfo[1:] < ofo[1:]:
                     return False
             else:
                 return False
         if self.hop_limit:
             # hop_limit looks like 'integer-integer' or just, 'integer'
-            shl = [int(x) for x in self.hop_limit.split('-')]
+            shl = _ParseRange(self.hop_limit)
             if other.hop_limit:
-                ohl = [int(x) for x in other.hop_limit.split('-')]
+                ohl = _ParseRange(other.hop_limit)
                 if shl[0] < ohl[0]:
                     return False
                 shll, ohll = shl[1:2], ohl[1:2]
@@ -667,9 +960,9 @@ class Term:
                 return False
         if self.packet_length:
             # packet_length looks like 'integer-integer' or just, 'integer'
-            spl = [int(x) for x in self.packet_length.split('-')]
+            spl = _ParseRange(self.packet_length)
             if other.packet_length:
-                opl = [int(x) for x in other.packet_length.split('-')]
+                opl = _ParseRange(other.packet_length)
                 if spl[0] < opl[0] or sorted(spl[1:]) > sorted(opl[1:]):
                     return False
             else:
@@ -678,149 +971,186 @@ class Term:
             if not other.port_mirror:
                 return False
         if self.icmp_type:
-            if sorted(self.icmp_type) is not sorted(other.icmp_type):
+            if sorted(self.icmp_type) != sorted(other.icmp_type):
                 return False
 
         if self.icmp_code:
-            if sorted(self.icmp_code) is not sorted(other.icmp_code):
+            if sorted(self.icmp_code) != sorted(other.icmp_code):
                 return False
 
         # check platform
         if self.platform:
-            if sorted(self.platform) is not sorted(other.platform):
+            if sorted(self.platform) != sorted(other.platform):
                 return False
         if self.platform_exclude:
-            if sorted(self.platform_exclude) is not sorted(other.platform_exclude):
+            if sorted(self.platform_exclude) != sorted(other.platform_exclude):
                 return False
 
         if self.source_zone:
-            if sorted(self.source_zone) is not sorted(other.source_zone):
+            if sorted(self.source_zone) != sorted(other.source_zone):
                 return False
 
         if self.destination_zone:
-            if sorted(self.destination_zone) is not sorted(other.destination_zone):
+            if sorted(self.destination_zone) != sorted(other.destination_zone):
                 return False
 
+        # check ports
+        # like the address directive, the port directive is special in that it can
+        # be either source or destination.
+        if self.port:
+            if not (
+                self.CheckPortIsContained(self.port, other.port)
+                or self.CheckPortIsContained(self.port, other.source_port)
+                or self.CheckPortIsContained(self.port, other.destination_port)
+            ):
+                return False
+        if not self.CheckPortIsContained(self.source_port, other.source_port):
+            return False
+        if not self.CheckPortIsContained(self.destination_port, other.destination_port):
+            return False
+
+        # flat 'address' is compared against other flat (saddr|daddr).
+        # if NONE of these evaluate to True other is not contained.
+        if not (
+            self.CheckAddressIsContained(self.flattened_addr, other.flattened_addr)
+            or self.CheckAddressIsContained(self.flattened_addr, other.flattened_saddr)
+            or self.CheckAddressIsContained(self.flattened_addr, other.flattened_daddr)
+        ):
+            return False
+
+        # compare flat address from other to flattened self (saddr|daddr).
+        if not (
+            # other's flat address needs both self saddr & daddr to contain in order
+            # for the term to be contained. We already compared the flattened_addr
+            # attributes of both above, which was not contained.
+            self.CheckAddressIsContained(other.flattened_addr, self.flattened_saddr)
+            and self.CheckAddressIsContained(other.flattened_addr, self.flattened_daddr)
+        ):
+            return False
+
+        # basic saddr/daddr check.
+        if not (self.CheckAddressIsContained(self.flattened_saddr, other.flattened_saddr)):
+            return False
+        if not (self.CheckAddressIsContained(self.flattened_daddr, other.flattened_daddr)):
+            return False
+
         # we have containment
         return True
 
     def __str__(self) -> str:
         ret_str = []
-        ret_str.append(' name: %s' % self.name)
+        append = ret_str.append
+        append(f' name: {self.name}')
         if self.address:
-            ret_str.append('  address: %s' % sorted(self.address))
+            append(f'  address: {sorted(self.address)}')
         if self.address_exclude:
-            ret_str.append('  address_exclude: %s' % sorted(self.address_exclude))
+            append(f'  address_exclude: {sorted(self.address_exclude)}')
         if self.source_address:
-            ret_str.append('  source_address: %s' % self._SortAddressesByFamily('source_address'))
+            addresses = self._SortAddressesByFamily('source_address')
+            append(f'  source_address: {addresses}')
         if self.source_address_exclude:
-            ret_str.append(
-                '  source_address_exclude: %s'
-                % self._SortAddressesByFamily('source_address_exclude')
-            )
+            addresses = self._SortAddressesByFamily('source_address_exclude')
+            append(f'  source_address_exclude: {addresses}')
         if self.source_fqdn:
-            ret_str.append(f'  source_fqdn: {self.source_fqdn}')
+            append(f'  source_fqdn: {self.source_fqdn}')
         if self.source_tag:
-            ret_str.append('  source_tag: %s' % self.source_tag)
+            append(f'  source_tag: {self.source_tag}')
         if self.destination_address:
-            ret_str.append(
-                '  destination_address: %s' % self._SortAddressesByFamily('destination_address')
-            )
+            addresses = self._SortAddressesByFamily('destination_address')
+            append(f'  destination_address: {addresses}')
         if self.destination_address_exclude:
-            ret_str.append(
-                '  destination_address_exclude: %s'
-                % self._SortAddressesByFamily('destination_address_exclude')
-            )
+            addresses = self._SortAddressesByFamily('destination_address_exclude')
+            append(f'  destination_address_exclude: {addresses}')
         if self.destination_fqdn:
-            ret_str.append(f'  destination_fqdn: {self.destination_fqdn}')
+            append(f'  destination_fqdn: {self.destination_fqdn}')
         if self.destination_tag:
-            ret_str.append('  destination_tag: %s' % self.destination_tag)
+            append(f'  destination_tag: {self.destination_tag}')
         if self.target_resources:
-            ret_str.append('  target_resources: %s' % self.target_resources)
+            append(f'  target_resources: {self.target_resources}')
         if self.target_service_accounts:
-            ret_str.append('  target_service_accounts: %s' % self.target_service_accounts)
+            append(f'  target_service_accounts: {self.target_service_accounts}')
         if self.source_prefix:
-            ret_str.append('  source_prefix: %s' % self.source_prefix)
+            append(f'  source_prefix: {self.source_prefix}')
         if self.source_prefix_except:
-            ret_str.append('  source_prefix_except: %s' % self.source_prefix_except)
+            append(f'  source_prefix_except: {self.source_prefix_except}')
         if self.destination_prefix:
-            ret_str.append('  destination_prefix: %s' % self.destination_prefix)
+            append(f'  destination_prefix: {self.destination_prefix}')
         if self.destination_prefix_except:
-            ret_str.append('  destination_prefix_except: %s' % self.destination_prefix_except)
+            append(f'  destination_prefix_except: {self.destination_prefix_except}')
         if self.filter_term:
-            ret_str.append('  filter_term: %s' % self.filter_term)
+            append(f'  filter_term: {self.filter_term}')
         if self.forwarding_class:
-            ret_str.append('  forwarding_class: %s' % self.forwarding_class)
+            append(f'  forwarding_class: {self.forwarding_class}')
         if self.forwarding_class_except:
-            ret_str.append('  forwarding_class_except: %s' % self.forwarding_class_except)
+            append(f'  forwarding_class_except: {self.forwarding_class_except}')
         if self.icmp_type:
-            ret_str.append('  icmp_type: %s' % sorted(self.icmp_type))
+            append(f'  icmp_type: {sorted(self.icmp_type)}')
         if self.icmp_code:
-            ret_str.append('  icmp_code: %s' % sorted(self.icmp_code))
+            append(f'  icmp_code: {sorted(self.icmp_code)}')
         if self.next_ip:
-            ret_str.append('  next_ip: %s' % self.next_ip)
+            append(f'  next_ip: {self.next_ip}')
         if self.encapsulate:
-            ret_str.append('  encapsulate: %s' % self.encapsulate)
+            append(f'  encapsulate: {self.encapsulate}')
         if self.protocol:
-            ret_str.append('  protocol: %s' % sorted(self.protocol))
+            append(f'  protocol: {sorted(self.protocol)}')
         if self.protocol_except:
-            ret_str.append('  protocol-except: %s' % self.protocol_except)
+            append(f'  protocol-except: {self.protocol_except}')
         if self.owner:
-            ret_str.append('  owner: %s' % self.owner)
+            append(f'  owner: {self.owner}')
         if self.port:
-            ret_str.append('  port: %s' % sorted(self.port))
+            append(f'  port: {sorted(self.port)}')
         if self.port_mirror:
-            ret_str.append('  port_mirror: %s' % self.port_mirror)
+            append(f'  port_mirror: {self.port_mirror}')
         if self.source_port:
-            ret_str.append('  source_port: %s' % sorted(self.source_port))
+            append(f'  source_port: {sorted(self.source_port)}')
         if self.destination_port:
-            ret_str.append('  destination_port: %s' % sorted(self.destination_port))
+            append(f'  destination_port: {sorted(self.destination_port)}')
         if self.action:
-            ret_str.append('  action: %s' % self.action)
+            append(f'  action: {self.action}')
         if self.option:
-            ret_str.append('  option: %s' % self.option)
+            append(f'  option: {self.option}')
         if self.flexible_match_range:
-            ret_str.append('  flexible_match_range: %s' % self.flexible_match_range)
+            append(f'  flexible_match_range: {self.flexible_match_range}')
         if self.qos:
-            ret_str.append('  qos: %s' % self.qos)
+            append(f'  qos: {self.qos}')
         if self.pan_application:
-            ret_str.append('  pan_application: %s' % self.pan_application)
+            append(f'  pan_application: {self.pan_application}')
         if self.logging:
-            ret_str.append('  logging: %s' % self.logging)
+            append(f'  logging: {self.logging}')
         if self.log_limit:
-            ret_str.append('  log_limit: %s/%s' % (self.log_limit[0], self.log_limit[1]))
+            append(f'  log_limit: {self.log_limit[0]}/{self.log_limit[1]}')
         if self.log_name:
-            ret_str.append('  log_name: %s' % self.log_name)
+            append(f'  log_name: {self.log_name}')
         if self.priority:
-            ret_str.append('  priority: %s' % self.priority)
+            append(f'  priority: {self.priority}')
         if self.counter:
-            ret_str.append('  counter: %s' % self.counter)
+            append(f'  counter: {self.counter}')
         if self.traffic_class_count:
-            ret_str.append('  traffic_class_count: %s' % self.traffic_class_count)
+            append(f'  traffic_class_count: {self.traffic_class_count}')
         if self.source_interface:
-            ret_str.append('  source_interface: %s' % self.source_interface)
+            append(f'  source_interface: {self.source_interface}')
         if self.destination_interface:
-            ret_str.append('  destination_interface: %s' % self.destination_interface)
+            append(f'  destination_interface: {self.destination_interface}')
         if self.expiration:
-            ret_str.append('  expiration: %s' % self.expiration)
+            append(f'  expiration: {self.expiration}')
         if self.platform:
-            ret_str.append('  platform: %s' % self.platform)
+            append(f'  platform: {self.platform}')
         if self.platform_exclude:
-            ret_str.append('  platform_exclude: %s' % self.platform_exclude)
+            append(f'  platform_exclude: {self.platform_exclude}')
         if self.ttl:
-            ret_str.append('  ttl: %s' % self.ttl)
+            append(f'  ttl: {self.ttl}')
         if self.timeout:
-            ret_str.append('  timeout: %s' % self.timeout)
+            append(f'  timeout: {self.timeout}')
         if self.vpn:
             vpn_name, pair_policy = self.vpn
             if pair_policy:
-                ret_str.append('  vpn: name = %s, pair_policy = %s' % (vpn_name, pair_policy))
+                append(f'  vpn: name = {vpn_name}, pair_policy = {pair_policy}')
             else:
-                ret_str.append('  vpn: name = %s' % vpn_name)
+                append(f'  vpn: name = {vpn_name}')
         if self.source_zone:
-            ret_str.append('  source_zone: %s' % sorted(self.source_zone))
+            append(f'  source_zone: {sorted(self.source_zone)}')
         if self.destination_zone:
-            ret_str.append('  destination_zone: %s' % sorted(self.destination_zone))
+            append(f'  destination_zone: {sorted(self.destination_zone)}')
 
         return '\n'.join(ret_str)
 
@@ -828,160 +1158,26 @@ class Term:
         return self.__str__()
 
     def __eq__(self, other: Term) -> bool:
-        # action
-        if sorted(self.action) != sorted(other.action):
-            return False
-
-        # addresses.
-        if not (
-            sorted(self.address) == sorted(other.address)
-            and sorted(self.source_address) == sorted(other.source_address)
-            and sorted(self.source_address_exclude) == sorted(other.source_address_exclude)
-            and sorted(self.destination_address) == sorted(other.destination_address)
-            and sorted(self.destination_address_exclude)
-            == sorted(other.destination_address_exclude)
-        ):
-            return False
-
-        # prefix lists
-        if not (
-            sorted(self.source_prefix) == sorted(other.source_prefix)
-            and sorted(self.source_prefix_except) == sorted(other.source_prefix_except)
-            and sorted(self.destination_prefix) == sorted(other.destination_prefix)
-            and sorted(self.destination_prefix_except) == sorted(other.destination_prefix_except)
-        ):
-            return False
-
-        # ports
-        if not (
-            sorted(self.port) == sorted(other.port)
-            and sorted(self.source_port) == sorted(other.source_port)
-            and sorted(self.destination_port) == sorted(other.destination_port)
-        ):
-            return False
-
-        # protocol
-        if not (
-            sorted(self.protocol) == sorted(other.protocol)
-            and sorted(self.protocol_except) == sorted(other.protocol_except)
-        ):
-            return False
-
-        # option
-        if sorted(self.option) != sorted(other.option):
-            return False
-
-        # qos
-        if self.qos != other.qos:
-            return False
-
-        # pan-application
-        if sorted(self.pan_application) != sorted(other.pan_application):
-            return False
-
-        # verbatim
-        if self.verbatim != other.verbatim:
-            return False
-
-        # policer
-        if self.policer != other.policer:
-            return False
-
-        # interface
-        if self.source_interface != other.source_interface:
-            return False
-
-        if self.destination_interface != other.destination_interface:
-            return False
-
-        # tags
-        if not (
-            sorted(self.source_tag) == sorted(other.source_tag)
-            and sorted(self.destination_tag) == sorted(other.destination_tag)
-        ):
-            return False
-
-        if self.ttl != other.ttl:
-            return False
-
-        if sorted(self.logging) != sorted(other.logging):
-            return False
-        if self.log_limit != other.log_limit:
-            return False
-        if self.qos != other.qos:
-            return False
-        if sorted(self.pan_application) != sorted(other.pan_application):
-            return False
-        if self.packet_length != other.packet_length:
-            return False
-        if self.fragment_offset != other.fragment_offset:
-            return False
-        if self.hop_limit != other.hop_limit:
-            return False
-        if sorted(self.icmp_type) != sorted(other.icmp_type):
-            return False
-        if sorted(self.icmp_code) != sorted(other.icmp_code):
-            return False
-        if sorted(self.ether_type) != sorted(other.ether_type):
-            return False
-        if sorted(self.traffic_type) != sorted(other.traffic_type):
-            return False
-
-        # vpn
-        if self.vpn != other.vpn:
-            return False
-
-        # platform
-        if not (
-            sorted(self.platform) == sorted(other.platform)
-            and sorted(self.platform_exclude) == sorted(other.platform_exclude)
-        ):
-            return False
-
-        # timeout
-        if self.timeout != other.timeout:
-            return False
-
-        # precedence
-        if self.precedence != other.precedence:
-            return False
-
-        # filter
-        if self.filter_term != other.filter_term:
-            return False
-
-        # forwarding-class
-        if sorted(self.forwarding_class) != sorted(other.forwarding_class):
-            return False
-
-        # forwarding-class-except
-        if sorted(self.forwarding_class_except) != sorted(other.forwarding_class_except):
-            return False
-
-        # next_ip
-        if self.next_ip != other.next_ip:
-            return False
-
-        # encapsulate
-        if self.encapsulate != other.encapsulate:
-            return False
-
-        # flexible_match
-        if self.flexible_match_range != other.flexible_match_range:
-            return False
-
-        # port_mirror
-        if self.port_mirror != other.port_mirror:
-            return False
-
-        # source_zone
-        if sorted(self.source_zone) != sorted(other.source_zone):
-            return False
-
-        # destination_zone
-        if sorted(self.destination_zone) != sorted(other.destination_zone):
-            return False
-
+        if self is other:
+            return True
+        # scalar attributes and list lengths are cheap to compare, so they go
+        # before anything that has to build a set or sort a list.
+        for attr in self._EQ_EXACT_ATTRIBUTES:
+            if getattr(self, attr) != getattr(other, attr):
+                return False
+        for attr in self._EQ_UNORDERED_ATTRIBUTES:
+            if len(getattr(self, attr)) != len(getattr(other, attr)):
+                return False
+        for attr in self._EQ_SET_ATTRIBUTES:
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            if mine == theirs:
+                continue
+            # differing lists of at most one value each cannot hold the same set.
+            if (len(mine) < 2 and len(theirs) < 2) or set(mine) != set(theirs):
+                return False
+        for attr in self._EQ_UNORDERED_ATTRIBUTES:
+            if not _SortedEqual(getattr(self, attr), getattr(other, attr)):
+                return False
         return True
 
     def __ne__(self, other: Term) -> bool:
@@ -1001,12 +1197,13 @@ class Term:
         Returns:
           List of IP addresses sourted v4 then v6
         """
-        # Sort v4 and v6
-        sort_v4 = sorted(self.GetAddressOfVersion(addr_type, 4))
-        sort_v6 = sorted(self.GetAddressOfVersion(addr_type, 6))
+        # Split by family in one pass, then sort v4 and v6 separately.
+        by_family = {4: [], 6: []}
+        for addr in getattr(self, addr_type):
+            by_family[addr.version].append(addr)
 
         # Concatenate
-        return sort_v4 + sort_v6
+        return sorted(by_family[4]) + sorted(by_family[6])
 
     def AddressesByteLength(self, address_family: Tuple[int, int] = (4, 6)) -> int:
         """Returns the byte length of all IP addresses in the term.
@@ -1019,17 +1216,13 @@ class Term:
         Returns:
           counter: Byte length of the sum of both source and destination IPs.
         """
+        versions = [addr.version for addr in self.source_address]
+        versions.extend(addr.version for addr in self.destination_address)
         counter = 0
-        for i in self.source_address:
-            if i.version == 6 and i.version in address_family:
-                counter += self._IPV6_BYTE_SIZE
-            elif i.version == 4 and i.version in address_family:
-                counter += self._IPV4_BYTE_SIZE
-        for i in self.destination_address:
-            if i.version == 6 and i.version in address_family:
-                counter += self._IPV6_BYTE_SIZE
-            elif i.version == 4 and i.version in address_family:
-                counter += self._IPV4_BYTE_SIZE
+        if 4 in address_family:
+            counter += versions.count(4) * self._IPV4_BYTE_SIZE
+        if 6 in address_family:
+            counter += versions.count(6) * self._IPV6_BYTE_SIZE
         return counter
 
     def FlattenAll(self, mutate: bool = True) -> None:
@@ -1053,21 +1246,19 @@ class Term:
             return
 
         if self.source_address_exclude:
-            self.flattened_saddr = nacaddr.AddressListExclude(
-                self.source_address, self.source_address_exclude, collapse_addrs=False
+            self.flattened_saddr = _ExcludeByFamily(
+                self.source_address, self.source_address_exclude
             )
             if mutate:
                 self.source_address = self.flattened_saddr
         if self.destination_address_exclude:
-            self.flattened_daddr = nacaddr.AddressListExclude(
-                self.destination_address, self.destination_address_exclude, collapse_addrs=False
+            self.flattened_daddr = _ExcludeByFamily(
+                self.destination_address, self.destination_address_exclude
             )
             if mutate:
                 self.destination_address = self.flattened_daddr
         if self.address_exclude:
-            self.flattened_addr = nacaddr.AddressListExclude(
-                self.address, self.address_exclude, collapse_addrs=False
-            )
+            self.flattened_addr = _ExcludeByFamily(self.address, self.address_exclude)
             if mutate:
                 self.address = self.flattened_addr
 
@@ -1104,93 +1295,30 @@ class Term:
             understand.
           InvalidTermLoggingError: when a option is set for logging not known.
         """
-        if type(obj) is list:
+        if isinstance(obj, list):
+            list_append = _TERM_LIST_APPEND.get
+            list_addresses = _TERM_LIST_ADDRESSES.get
             for x in obj:
-                # do we have a list of addresses?
+                var_type = x.var_type
+                # most types append their value to a list attribute.
+                attr = list_append(var_type)
+                if attr:
+                    if var_type in _TERM_INTERNED:
+                        getattr(self, attr).append(_Intern(x.value))
+                    else:
+                        getattr(self, attr).append(x.value)
+                    continue
+                # do we have a list of addresses or address excludes?
                 # expanded address fields consolidate naked address fields with
                 # saddr/daddr.
-                if x.var_type is VarType.SADDRESS:
-                    saddr = DEFINITIONS.GetNetAddr(x.value)
-                    self.source_address.extend(saddr)
-                elif x.var_type is VarType.DADDRESS:
-                    daddr = DEFINITIONS.GetNetAddr(x.value)
-                    self.destination_address.extend(daddr)
-                elif x.var_type is VarType.ADDRESS:
-                    addr = DEFINITIONS.GetNetAddr(x.value)
-                    self.address.extend(addr)
-                # do we have address excludes?
-                elif x.var_type is VarType.SADDREXCLUDE:
-                    saddr_exclude = DEFINITIONS.GetNetAddr(x.value)
-                    self.source_address_exclude.extend(saddr_exclude)
-                elif x.var_type is VarType.DADDREXCLUDE:
-                    daddr_exclude = DEFINITIONS.GetNetAddr(x.value)
-                    self.destination_address_exclude.extend(daddr_exclude)
-                elif x.var_type is VarType.ADDREXCLUDE:
-                    addr_exclude = DEFINITIONS.GetNetAddr(x.value)
-                    self.address_exclude.extend(addr_exclude)
-                # do we have a list of ports?
-                elif x.var_type is VarType.PORT:
-                    self.port.append(x.value)
-                elif x.var_type is VarType.SPORT:
-                    self.source_port.append(x.value)
-                elif x.var_type is VarType.DPORT:
-                    self.destination_port.append(x.value)
-                # do we have a list of protocols?
-                elif x.var_type is VarType.PROTOCOL:
-                    self.protocol.append(x.value)
-                # do we have a list of protocol-exceptions?
-                elif x.var_type is VarType.PROTOCOL_EXCEPT:
-                    self.protocol_except.append(x.value)
-                # do we have a list of options?
-                elif x.var_type is VarType.OPTION:
-                    self.option.append(x.value)
-                elif x.var_type is VarType.SPFX:
-                    self.source_prefix.append(x.value)
-                elif x.var_type is VarType.ESPFX:
-                    self.source_prefix_except.append(x.value)
-                elif x.var_type is VarType.DPFX:
-                    self.destination_prefix.append(x.value)
-                elif x.var_type is VarType.EDPFX:
-                    self.destination_prefix_except.append(x.value)
-                elif x.var_type is VarType.ETHER_TYPE:
-                    self.ether_type.append(x.value)
-                elif x.var_type is VarType.TRAFFIC_TYPE:
-                    self.traffic_type.append(x.value)
-                elif x.var_type is VarType.PRECEDENCE:
-                    self.precedence.append(x.value)
-                elif x.var_type is VarType.FORWARDING_CLASS:
-                    self.forwarding_class.append(x.value)
-                elif x.var_type is VarType.FORWARDING_CLASS_EXCEPT:
-                    self.forwarding_class_except.append(x.value)
-                elif x.var_type is VarType.PAN_APPLICATION:
-                    self.pan_application.append(x.value)
-                elif x.var_type is VarType.NEXT_IP:
-                    self.next_ip = DEFINITIONS.GetNetAddr(x.value)
-                elif x.var_type is VarType.PLATFORM:
-                    self.platform.append(x.value)
-                elif x.var_type is VarType.PLATFORMEXCLUDE:
-                    self.platform_exclude.append(x.value)
-                elif x.var_type is VarType.DSCP_MATCH:
-                    self.dscp_match.append(x.value)
-                elif x.var_type is VarType.DSCP_EXCEPT:
-                    self.dscp_except.append(x.value)
-                elif x.var_type is VarType.STAG:
-                    self.source_tag.append(x.value)
-                elif x.var_type is VarType.DTAG:
-                    self.destination_tag.append(x.value)
-                elif x.var_type is VarType.FLEXIBLE_MATCH_RANGE:
-                    self.flexible_match_range.append(x.value)
-                elif x.var_type is VarType.TARGET_RESOURCES:
-                    self.target_resources.append(x.value)
-                elif x.var_type is VarType.TARGET_SERVICE_ACCOUNTS:
-                    self.target_service_accounts.append(x.value)
-                elif x.var_type is VarType.SZONE:
-                    self.source_zone.append(x.value)
-                elif x.var_type is VarType.DZONE:
-                    self.destination_zone.append(x.value)
-                elif x.var_type is VarType.DESTINATION_FQDN:
+                attr = list_addresses(var_type)
+                if attr:
+                    getattr(self, attr).extend(_ResolveNetAddr(x.value))
+                elif var_type is VarType.NEXT_IP:
+                    self.next_ip = _ResolveNetAddr(x.value)
+                elif var_type is VarType.DESTINATION_FQDN:
                     self.destination_fqdn.extend(DEFINITIONS.GetFQDN(x.value))
-                elif x.var_type is VarType.SOURCE_FQDN:
+                elif var_type is VarType.SOURCE_FQDN:
                     self.source_fqdn.extend(DEFINITIONS.GetFQDN(x.value))
                 else:
                     raise TermObjectTypeError(
@@ -1198,41 +1326,27 @@ class Term:
                         % (type(x), x.value)
                     )
         else:
-            # stupid no switch statement in python
-            if obj.var_type is VarType.RESTRICT_ADDRESS_FAMILY:
-                self.restrict_address_family = obj.value
-            elif obj.var_type is VarType.COMMENT:
+            attr = _TERM_SCALAR_SET.get(obj.var_type)
+            if attr:
+                setattr(self, attr, obj.value)
+                return
+            attr = _TERM_SCALAR_APPEND.get(obj.var_type)
+            if attr:
+                if obj.var_type in _TERM_INTERNED:
+                    getattr(self, attr).append(_Intern(obj.value))
+                else:
+                    getattr(self, attr).append(obj.value)
+                return
+            if obj.var_type is VarType.COMMENT:
                 self.comment.append(str(obj))
-            elif obj.var_type is VarType.OWNER:
-                self.owner = obj.value
-            elif obj.var_type is VarType.EXPIRATION:
-                self.expiration = obj.value
-            elif obj.var_type is VarType.LOSS_PRIORITY:
-                self.loss_priority = obj.value
-            elif obj.var_type is VarType.ROUTING_INSTANCE:
-                self.routing_instance = obj.value
-            elif obj.var_type is VarType.PRECEDENCE:
-                self.precedence = obj.value
-            elif obj.var_type is VarType.FORWARDING_CLASS:
-                self.forwarding_class.append(obj.value)
-            elif obj.var_type is VarType.FORWARDING_CLASS_EXCEPT:
-                self.forwarding_class_except.append(obj.value)
-            elif obj.var_type is VarType.PAN_APPLICATION:
-                self.pan_application.append(obj.value)
             elif obj.var_type is VarType.NEXT_IP:
-                self.next_ip = DEFINITIONS.GetNetAddr(obj.value)
-            elif obj.var_type is VarType.VERBATIM:
-                self.verbatim.append(obj.value)
+                self.next_ip = _ResolveNetAddr(obj.value)
             elif obj.var_type is VarType.ACTION:
                 if str(obj) not in ACTIONS:
                     raise InvalidTermActionError('%s is not a valid action' % obj)
-                self.action.append(obj.value)
+                self.action.append(_Intern(obj.value))
             elif obj.var_type is VarType.COUNTER:
                 self.counter = obj
-            elif obj.var_type is VarType.ENCAPSULATE:
-                self.encapsulate = obj.value
-            elif obj.var_type is VarType.PORT_MIRROR:
-                self.port_mirror = obj.value
             elif obj.var_type is VarType.TRAFFIC_CLASS_COUNT:
                 self.traffic_class_count = obj
             elif obj.var_type is VarType.ICMP_TYPE:
@@ -1243,42 +1357,10 @@ class Term:
                 if str(obj) not in _LOGGING:
                     raise InvalidTermLoggingError('%s is not a valid logging option' % obj)
                 self.logging.append(obj)
-            elif obj.var_type is VarType.LOG_LIMIT:
-                self.log_limit = obj.value
-            elif obj.var_type is VarType.LOG_NAME:
-                self.log_name = obj.value
-            # police man, tryin'a take you jail
-            elif obj.var_type is VarType.POLICER:
-                self.policer = obj.value
-            elif obj.var_type is VarType.PRIORITY:
-                self.priority = obj.value
-            # qos?
-            elif obj.var_type is VarType.QOS:
-                self.qos = obj.value
-            elif obj.var_type is VarType.PACKET_LEN:
-                self.packet_length = obj.value
-            elif obj.var_type is VarType.FRAGMENT_OFFSET:
-                self.fragment_offset = obj.value
-            elif obj.var_type is VarType.HOP_LIMIT:
-                self.hop_limit = obj.value
-            elif obj.var_type is VarType.SINTERFACE:
-                self.source_interface = obj.value
-            elif obj.var_type is VarType.DINTERFACE:
-                self.destination_interface = obj.value
-            elif obj.var_type is VarType.TIMEOUT:
-                self.timeout = obj.value
-            elif obj.var_type is VarType.DSCP_SET:
-                self.dscp_set = obj.value
             elif obj.var_type is VarType.VPN:
                 self.vpn = (obj.value[0], obj.value[1])
             elif obj.var_type is VarType.TTL:
                 self.ttl = int(obj.value)
-            elif obj.var_type is VarType.TARGET_RESOURCES:
-                self.target_resources.append(obj.value)
-            elif obj.var_type is VarType.TARGET_SERVICE_ACCOUNTS:
-                self.target_service_accounts.append(obj.value)
-            elif obj.var_type is VarType.FILTER_TERM:
-                self.filter_term = obj.value
             else:
                 raise TermObjectTypeError('%s isn\'t a type I know how to deal with' % (type(obj)))
 
@@ -1332,17 +1414,16 @@ class Term:
                     'term "%s" has both filter and action tokens.' % self.name
                 )
             # have we specified a port with a protocol that doesn't support ports?
-            protos_no_ports = {p for p in self.protocol if p not in PROTOS_WITH_PORTS}
-            if protos_no_ports != set() and (
-                self.source_port or self.destination_port or self.port
-            ):
-                if set(self.protocol) - protos_no_ports != set():
+            if self.source_port or self.destination_port or self.port:
+                protocols = set(self.protocol)
+                protos_no_ports = protocols - PROTOS_WITH_PORTS
+                if protos_no_ports and protocols - protos_no_ports:
                     # This is a more specific error - some protocols support, but not all
                     raise MixedPortandNonPortProtos(
                         'Term %s contains mixed uses of protocols with and without port '
                         'numbers\nProtocols: %s' % (self.name, self.protocol)
                     )
-                else:
+                elif protos_no_ports:
                     raise TermPortProtocolError(
                         'ports specified with protocol(s) that don\'t support ports. '
                         'Term: %s Protocols: %s ' % (self.name, protos_no_ports)
@@ -1378,10 +1459,8 @@ class Term:
                     'Use only one ICMP type.\n Term: %s' % self.name
                 )
             type_name = self.icmp_type[0]
-            bad_codes = []
-            for code in self.icmp_code:
-                if code not in self.ICMP_CODE[type_name]:
-                    bad_codes.append(code)
+            valid_codes = _ICMP_CODES[type_name]
+            bad_codes = [code for code in self.icmp_code if code not in valid_codes]
             if bad_codes:
                 raise ICMPCodeError(
                     'ICMP Codes %s are invalid for ICMP Type %s.'
@@ -1389,7 +1468,7 @@ class Term:
                 )
         if self.icmp_type:
             for icmptype in self.icmp_type:
-                if icmptype not in self.ICMP_TYPE[4] and icmptype not in self.ICMP_TYPE[6]:
+                if icmptype not in ICMP_TYPE_NAMES:
                     raise TermInvalidIcmpType(
                         'Term %s contains an invalid icmp-type:' '%s' % (self.name, icmptype)
                     )
@@ -1401,7 +1480,7 @@ class Term:
                 )
         for proto in self.protocol:
             if proto.isnumeric():
-                if int(proto) < 0 or 255 < int(proto):
+                if not 0 <= int(proto) <= 255:
                     raise InvalidNumericProtoValue(
                         f'Term {self.name} has protocol={self.protocol}. Numeric protocol values must be between 0 and 255.'
                     )
@@ -1411,7 +1490,8 @@ class Term:
 
         Notes:
           Collapses both the address definitions and the port definitions
-          to their smallest possible length.
+          to their smallest possible length. Exact repeats of an address, such
+          as from a token named twice, are dropped even when not optimizing.
 
         Args:
           optimize: boolean value indicating whether to optimize addresses
@@ -1419,6 +1499,9 @@ class Term:
         """
 
         def cleanup(addresses, complement_addresses):
+            # a token named twice leaves exact repeats; drop them once per term,
+            # before sorting or collapsing.
+            addresses = _DedupAddresses(addresses)
             if not optimize:
                 return nacaddr.SortAddrList(addresses)
             if addressbook:
@@ -1465,20 +1548,14 @@ class Term:
         """
         ret_ports = []
         for port in sorted(ports):
-            if not ret_ports:
+            if not ret_ports or port[0] > ret_ports[-1][1] + 1:
+                # (10, 20) and (22, 30) -> (10, 20), (22, 30)
                 ret_ports.append(port)
-            elif ret_ports[-1][1] >= port[1]:
-                # (10, 20) and (12, 13) -> (10, 20)
-                pass
-            elif port[0] < ret_ports[-1][1] < port[1]:
+            elif port[1] > ret_ports[-1][1]:
                 # (10, 20) and (15, 30) -> (10, 30)
-                ret_ports[-1] = (ret_ports[-1][0], port[1])
-            elif ret_ports[-1][1] + 1 == port[0]:
                 # (10, 20) and (21, 30) -> (10, 30)
                 ret_ports[-1] = (ret_ports[-1][0], port[1])
-            else:
-                # (10, 20) and (22, 30) -> (10, 20), (22, 30)
-                ret_ports.append(port)
+            # otherwise (10, 20) and (12, 13) -> (10, 20)
         return ret_ports
 
     def CheckProtocolIsContained(self, superset: List[str], subset: List[str]) -> bool:
@@ -1520,13 +1597,22 @@ class Term:
         if not subset:
             return False
 
-        for sub_port in subset:
-            not_contains = True
-            for sup_port in superset:
-                if int(sub_port[0]) >= int(sup_port[0]) and int(sub_port[1]) <= int(sup_port[1]):
-                    not_contains = False
-                    break
-            if not_contains:
+        if len(superset) < _LINEAR_CONTAINMENT_MAX:
+            for sub_port in subset:
+                not_contains = True
+                for sup_port in superset:
+                    if int(sub_port[0]) >= int(sup_port[0]) and int(sub_port[1]) <= int(
+                        sup_port[1]
+                    ):
+                        not_contains = False
+                        break
+                if not_contains:
+                    return False
+            return True
+
+        index = _RangeIndex((int(low), int(high)) for low, high in superset)
+        for low, high in subset:
+            if not _RangeIndexContains(index, int(low), int(high)):
                 return False
         return True
 
@@ -1547,21 +1633,48 @@ class Term:
         if not subset:
             return False
 
+        if len(superset) < _LINEAR_CONTAINMENT_MAX:
+            for sub_addr in subset:
+                sub_contained = False
+                for sup_addr in superset:
+                    # ipaddr ensures that version numbers match for inclusion.
+                    if sub_addr.subnet_of(sup_addr):
+                        sub_contained = True
+                        break
+                if not sub_contained:
+                    return False
+            return True
+
+        # Compare addresses as integer ranges, separately for each version.
+        versions = {4: [], 6: []}
+        for sup_addr in superset:
+            versions[sup_addr.version].append(
+                (int(sup_addr.network_address), int(sup_addr.broadcast_address))
+            )
+        indexes = {version: _RangeIndex(ranges) for version, ranges in versions.items()}
+
         for sub_addr in subset:
-            sub_contained = False
-            for sup_addr in superset:
-                # ipaddr ensures that version numbers match for inclusion.
-                if sub_addr.subnet_of(sup_addr):
-                    sub_contained = True
-                    break
-            if not sub_contained:
+            # only addresses of the same version can contain one another.
+            if not _RangeIndexContains(
+                indexes[sub_addr.version],
+                int(sub_addr.network_address),
+                int(sub_addr.broadcast_address),
+            ):
                 return False
         return True
 
 
+# Every ICMP type name known for either address family, and the valid codes of
+# each ICMP type, for membership tests during validation.
+ICMP_TYPE_NAMES = frozenset(Term.ICMP_TYPE[4]).union(Term.ICMP_TYPE[6])
+_ICMP_CODES = {name: frozenset(codes) for name, codes in Term.ICMP_CODE.items()}
+
+
 class VarType:
     """Generic object meant to store lots of basic policy types."""
 
+    __slots__ = ('var_type', 'value')
+
     COMMENT = 0
     COUNTER = 1
     ACTION = 2
@@ -1636,8 +1749,12 @@ class VarType:
         if self.var_type == self.COMMENT or self.var_type == self.LOG_NAME:
             # remove the double quotes
             val = str(value).strip('"')
-            # make all of the lines start w/o leading whitespace.
-            self.value = '\n'.join([x.lstrip() for x in val.splitlines()])
+            # make all of the lines start w/o leading whitespace. Line breaks are
+            # never printable, so printable values are a single line.
+            if val.isprintable():
+                self.value = val.lstrip()
+            else:
+                self.value = '\n'.join([x.lstrip() for x in val.splitlines()])
         else:
             self.value = value
 
@@ -1654,14 +1771,117 @@ class VarType:
         return id(self)
 
 
+# Term attributes filled in by Term.AddObject, keyed by VarType. Values given
+# as a list of VarTypes are appended or, for addresses, resolved and extended.
+_TERM_LIST_APPEND = {
+    VarType.PORT: 'port',
+    VarType.SPORT: 'source_port',
+    VarType.DPORT: 'destination_port',
+    VarType.PROTOCOL: 'protocol',
+    VarType.PROTOCOL_EXCEPT: 'protocol_except',
+    VarType.OPTION: 'option',
+    VarType.SPFX: 'source_prefix',
+    VarType.ESPFX: 'source_prefix_except',
+    VarType.DPFX: 'destination_prefix',
+    VarType.EDPFX: 'destination_prefix_except',
+    VarType.ETHER_TYPE: 'ether_type',
+    VarType.TRAFFIC_TYPE: 'traffic_type',
+    VarType.PRECEDENCE: 'precedence',
+    VarType.FORWARDING_CLASS: 'forwarding_class',
+    VarType.FORWARDING_CLASS_EXCEPT: 'forwarding_class_except',
+    VarType.PAN_APPLICATION: 'pan_application',
+    VarType.PLATFORM: 'platform',
+    VarType.PLATFORMEXCLUDE: 'platform_exclude',
+    VarType.DSCP_MATCH: 'dscp_match',
+    VarType.DSCP_EXCEPT: 'dscp_except',
+    VarType.STAG: 'source_tag',
+    VarType.DTAG: 'destination_tag',
+    VarType.FLEXIBLE_MATCH_RANGE: 'flexible_match_range',
+    VarType.TARGET_RESOURCES: 'target_resources',
+    VarType.TARGET_SERVICE_ACCOUNTS: 'target_service_accounts',
+    VarType.SZONE: 'source_zone',
+    VarType.DZONE: 'destination_zone',
+}
+# Values repeated across many terms, such as protocol, zone and tag names, are
+# stored interned.
+_TERM_INTERNED = frozenset(
+    (
+        VarType.PROTOCOL,
+        VarType.PROTOCOL_EXCEPT,
+        VarType.OPTION,
+        VarType.PLATFORM,
+        VarType.PLATFORMEXCLUDE,
+        VarType.ETHER_TYPE,
+        VarType.TRAFFIC_TYPE,
+        VarType.FORWARDING_CLASS,
+        VarType.FORWARDING_CLASS_EXCEPT,
+        VarType.PAN_APPLICATION,
+        VarType.STAG,
+        VarType.DTAG,
+        VarType.SZONE,
+        VarType.DZONE,
+    )
+)
+_TERM_LIST_ADDRESSES = {
+    VarType.SADDRESS: 'source_address',
+    VarType.DADDRESS: 'destination_address',
+    VarType.ADDRESS: 'address',
+    VarType.SADDREXCLUDE: 'source_address_exclude',
+    VarType.DADDREXCLUDE: 'destination_address_exclude',
+    VarType.ADDREXCLUDE: 'address_exclude',
+}
+# Single VarTypes either set a scalar attribute or append to a list.
+_TERM_SCALAR_SET = {
+    VarType.RESTRICT_ADDRESS_FAMILY: 'restrict_address_family',
+    VarType.OWNER: 'owner',
+    VarType.EXPIRATION: 'expiration',
+    VarType.LOSS_PRIORITY: 'loss_priority',
+    VarType.ROUTING_INSTANCE: 'routing_instance',
+    VarType.PRECEDENCE: 'precedence',
+    VarType.ENCAPSULATE: 'encapsulate',
+    VarType.PORT_MIRROR: 'port_mirror',
+    VarType.LOG_LIMIT: 'log_limit',
+    VarType.LOG_NAME: 'log_name',
+    VarType.POLICER: 'policer',
+    VarType.PRIORITY: 'priority',
+    VarType.QOS: 'qos',
+    VarType.PACKET_LEN: 'packet_length',
+    VarType.FRAGMENT_OFFSET: 'fragment_offset',
+    VarType.HOP_LIMIT: 'hop_limit',
+    VarType.SINTERFACE: 'source_interface',
+    VarType.DINTERFACE: 'destination_interface',
+    VarType.TIMEOUT: 'timeout',
+    VarType.DSCP_SET: 'dscp_set',
+    VarType.FILTER_TERM: 'filter_term',
+}
+_TERM_SCALAR_APPEND = {
+    VarType.FORWARDING_CLASS: 'forwarding_class',
+    VarType.FORWARDING_CLASS_EXCEPT: 'forwarding_class_except',
+    VarType.PAN_APPLICATION: 'pan_application',
+    VarType.VERBATIM: 'verbatim',
+    VarType.TARGET_RESOURCES: 'target_resources',
+    VarType.TARGET_SERVICE_ACCOUNTS: 'target_service_accounts',
+}
+
+
 class Header:
     """The header of the policy file contains the targets and a global comment."""
 
+    __slots__ = (
+        'target',
+        'comment',
+        'apply_groups',
+        'apply_groups_except',
+        '_targets_by_platform',
+    )
+
     def __init__(self) -> None:
         self.target = []
         self.comment = []
         self.apply_groups = []
         self.apply_groups_except = []
+        # targets in order of appearance, keyed by platform.
+        self._targets_by_platform = {}
 
     def AddObject(self, obj: Union[Target, VarType]) -> None:
         """Add and object to the Header.
@@ -1673,8 +1893,9 @@ class Header:
         Raises:
           RuntimeError: if object type cannot be determined
         """
-        if type(obj) == Target:
+        if isinstance(obj, Target):
             self.target.append(obj)
+            self._targets_by_platform.setdefault(obj.platform, []).append(obj)
         elif isinstance(obj, list) and all(isinstance(x, VarType) for x in obj):
             for x in obj:
                 if x.var_type == VarType.APPLY_GROUPS:
@@ -1700,9 +1921,9 @@ class Header:
         Returns:
           list or None
         """
-        for target in self.target:
-            if target.platform == platform:
-                return target.options
+        targets = self._targets_by_platform.get(platform)
+        if targets:
+            return targets[0].options
         return []
 
     def FilterName(self, platform: str) -> None:
@@ -1717,24 +1938,25 @@ class Header:
         Notes:
           !! Deprecated in favor of Header.FilterOptions(platform) !!
         """
-        for target in self.target:
-            if target.platform == platform:
-                if target.options:
-                    if platform in ['srx', 'paloalto']:
-                        if len(target.options) >= 3:
-                            return '%s>%s' % (target.options[1], target.options[3])
-                        else:
-                            return None
+        for target in self._targets_by_platform.get(platform, ()):
+            if target.options:
+                if platform in ['srx', 'paloalto']:
+                    if len(target.options) >= 3:
+                        return '%s>%s' % (target.options[1], target.options[3])
                     else:
-                        return target.options[0]
+                        return None
+                else:
+                    return target.options[0]
         return None
 
     def __str__(self) -> str:
-        return 'Target[%s], Comments [%s], Apply groups: [%s], except: [%s]' % (
-            ', '.join(map(str, self.target)),
-            ', '.join(self.comment),
-            ', '.join(self.apply_groups),
-            ', '.join(self.apply_groups_except),
+        targets = ', '.join([str(x) for x in self.target])
+        comments = ', '.join(self.comment)
+        apply_groups = ', '.join(self.apply_groups)
+        apply_groups_except = ', '.join(self.apply_groups_except)
+        return (
+            f'Target[{targets}], Comments [{comments}], Apply groups: [{apply_groups}], '
+            f'except: [{apply_groups_except}]'
         )
 
     def __repr__(self):
@@ -1752,6 +1974,8 @@ class Header:
           True if all the list member variables of this object are equal to the list
           member variables of obj and False otherwise.
         """
+        if self is obj:
+            return True
         if not isinstance(obj, Header):
             return False
         if self.target != obj.target:
@@ -1772,6 +1996,8 @@ class Header:
 class Target:
     """The type of acl to be rendered from this policy file."""
 
+    __slots__ = ('platform', 'options')
+
     def __init__(self, target: List[str]) -> None:
         self.platform = target[0]
         self.options = target[1:]
@@ -1785,9 +2011,6 @@ class Target:
     def __eq__(self, other: Target) -> bool:
         return self.platform == other.platform and self.options == other.options
 
-    def __ne__(self, other) -> bool:
-        return not self.__eq__(other)
-
 
 # Lexing/Parsing starts here
 tokens = (
@@ -1874,11 +2097,6 @@ tokens = (
 )
 
 literals = r':{},-/'
-t_ignore = ' \t'
-t_LSQUARE = r'\['
-t_RSQUARE = r'\]'
-t_LPAREN = r'\('
-t_RPAREN = r'\)'
 
 reserved = {
     'action': 'ACTION',
@@ -1961,62 +2179,131 @@ reserved = {
 # pylint: disable=g-docstring-missing-newline
 
 
-def t_IGNORE_COMMENT(t):
-    r'\#.*'
-    pass
-
-
-def t_ESCAPEDSTRING(t):
-    r'"([^"\\]*(?:\\"[^"\\]*)+)"'
-    t.lexer.lineno += str(t.value).count('\n')
-    return t
-
-
-def t_DQUOTEDSTRING(t: LexToken) -> LexToken:
-    r'"[^"]*?"'
-    t.lexer.lineno += str(t.value).count('\n')
-    return t
-
-
-def t_newline(t: LexToken) -> None:
-    r'\n+'
-    t.lexer.lineno += len(t.value)
-
-
-def t_error(t):
-    print("Illegal character '%s' on line %s" % (t.value[0], t.lineno))
-    t.lexer.skip(1)
-
-
-def t_DSCP_RANGE(t):
-    # pylint: disable=line-too-long
-    r'\b((b[0-1]{6})|(af[1-4]{1}[1-3]{1})|(be)|(ef)|(cs[0-7]{1}))([-]{1})((b[0-1]{6})|(af[1-4]{1}[1-3]{1})|(be)|(ef)|(cs[0-7]{1}))\b'
-    t.type = reserved.get(t.value, 'DSCP_RANGE')
-    return t
-
-
-def t_DSCP(t):
+_DSCP_VALUE = r'(?:b[01]{6}|af[1-4][1-3]|be|ef|cs[0-7])'
+# Token rules in match order; whitespace, comments and newlines are consumed but
+# produce no tokens, STRING tokens are checked against the reserved words and
+# literals are their own token type.
+_TOKEN_RULES = (
+    ('IGNORE', r'[ \t]+'),
+    ('IGNORE_COMMENT', r'\#.*'),
+    ('ESCAPEDSTRING', r'"([^"\\]*(?:\\"[^"\\]*)+)"'),
+    ('DQUOTEDSTRING', r'"[^"]*?"'),
+    ('NEWLINE', r'\n+'),
+    ('DSCP_RANGE', r'\b%s-%s\b' % (_DSCP_VALUE, _DSCP_VALUE)),
     # we need to handle the '-' as part of the word, not as a boundary
-    r'\b((b[0-1]{6})|(af[1-4]{1}[1-3]{1})|(be)|(ef)|(cs[0-7]{1}))(?![\w-])\b'
-    t.type = reserved.get(t.value, 'DSCP')
-    return t
-
-
-def t_HEX(t):
-    r'0x[a-fA-F0-9]+'
-    return t
+    ('DSCP', r'\b%s(?![\w-])' % _DSCP_VALUE),
+    ('HEX', r'0x[a-fA-F0-9]+'),
+    ('INTEGER', r'\d+'),
+    ('STRING', r'\w+([-_+.@/]\w*)*'),
+    ('LSQUARE', r'\['),
+    ('RSQUARE', r'\]'),
+    ('LPAREN', r'\('),
+    ('RPAREN', r'\)'),
+    ('LITERAL', '[%s]' % re.escape(literals)),
+)
+_TOKEN_RE = re.compile('|'.join('(?P<%s>%s)' % rule for rule in _TOKEN_RULES), re.VERBOSE)
 
 
-def t_INTEGER(t: LexToken) -> LexToken:
-    r'\d+'
-    return t
+class _Lexer:
+    """Policy tokenizer for the yacc parser.
 
+    All token rules are matched by one compiled pattern, so each token costs a
+    single regex match with no per-rule callback.
+    """
 
-def t_STRING(t: LexToken) -> LexToken:
-    r'\w+([-_+.@/]\w*)*'
-    # we have an identifier; let's check if it's a keyword or just a string.
-    t.type = reserved.get(t.value, 'STRING')
-    return t
+    def __init__(self) -> None:
+        self.lexdata = ''
+        self.lexpos = 0
+        self.lineno = 1
+        self._tokens = iter(())
+
+    def clone(self) -> _Lexer:
+        return _Lexer()
+
+    def input(self, data: str) -> None:
+        self.lexdata = data
+        self.lexpos = 0
+        self._tokens = self._Scan()
+
+    def token(self) -> Optional[LexToken]:
+        return next(self._tokens, None)
+
+    def _Token(self, token_type: str, value: str, lexpos: int) -> LexToken:
+        tok = LexToken()
+        tok.type = token_type
+        tok.value = value
+        tok.lineno = self.lineno
+        tok.lexpos = lexpos
+        tok.lexer = self
+        return tok
+
+    def _Scan(self) -> Iterator[LexToken]:
+        data = self.lexdata
+        end = len(data)
+        match = _TOKEN_RE.match
+        keyword = reserved.get
+        intern = sys.intern
+        pos = 0
+        while pos < end:
+            m = match(data, pos)
+            if m is None:
+                print("Illegal character '%s' on line %s" % (data[pos], self.lineno))
+                pos += 1
+                self.lexpos = pos
+                continue
+            kind = m.lastgroup
+            start, pos = pos, m.end()
+            self.lexpos = pos
+            if kind == 'IGNORE':
+                continue
+            if kind == 'NEWLINE':
+                self.lineno += pos - start
+            elif kind == 'STRING':
+                # names such as networks, services and protocols repeat across
+                # a policy, so terms share one copy of each.
+                value = intern(m.group())
+                # we have an identifier; let's check if it's a keyword or just a string.
+                yield self._Token(keyword(value, 'STRING'), value, start)
+            elif kind == 'LITERAL':
+                value = m.group()
+                yield self._Token(value, value, start)
+            elif kind == 'DSCP' or kind == 'DSCP_RANGE':
+                yield self._Token(kind, intern(m.group()), start)
+            elif kind != 'IGNORE_COMMENT':
+                value = m.group()
+                yield self._Token(kind, value, start)
+                if kind == 'ESCAPEDSTRING' or kind == 'DQUOTEDSTRING':
+                    self.lineno += value.count('\n')
+
+
+# VarTypes for keywords whose grammar rules cover several related fields.
+_KEYWORD_VAR_TYPES = {
+    'source-address': VarType.SADDRESS,
+    'destination-address': VarType.DADDRESS,
+    'address': VarType.ADDRESS,
+    'source-exclude': VarType.SADDREXCLUDE,
+    'destination-exclude': VarType.DADDREXCLUDE,
+    'address-exclude': VarType.ADDREXCLUDE,
+    'protocol-except': VarType.PROTOCOL_EXCEPT,
+    'source-prefix': VarType.SPFX,
+    'source-prefix-except': VarType.ESPFX,
+    'destination-prefix': VarType.DPFX,
+    'destination-prefix-except': VarType.EDPFX,
+    'source-port': VarType.SPORT,
+    'destination-port': VarType.DPORT,
+    'port': VarType.PORT,
+    'source-tag': VarType.STAG,
+    'destination-tag': VarType.DTAG,
+    'source-zone': VarType.SZONE,
+    'destination-zone': VarType.DZONE,
+    'source-interface': VarType.SINTERFACE,
+    'destination-interface': VarType.DINTERFACE,
+    'platform': VarType.PLATFORM,
+    'platform-exclude': VarType.PLATFORMEXCLUDE,
+    'packet-length': VarType.PACKET_LEN,
+    'fragment-offset': VarType.FRAGMENT_OFFSET,
+    'hop-limit': VarType.HOP_LIMIT,
+}
 
 
 ###
@@ -2026,7 +2313,7 @@ def p_target(p: YaccProduction) -> None:
     """target : target header terms
     |"""
     if len(p) > 1:
-        if type(p[1]) is Policy:
+        if isinstance(p[1], Policy):
             p[1].AddFilter(p[2], p[3])
             p[0] = p[1]
         else:
@@ -2045,7 +2332,7 @@ def p_header_spec(p: YaccProduction) -> None:
     | header_spec apply_groups_except_spec
     |"""
     if len(p) > 1:
-        if type(p[1]) == Header:
+        if isinstance(p[1], Header):
             p[1].AddObject(p[2])
             p[0] = p[1]
         else:
@@ -2065,7 +2352,7 @@ def p_terms(p: YaccProduction) -> None:
     |"""
     if len(p) > 1:
         p[5].name = p[3]
-        if type(p[1]) == list:
+        if isinstance(p[1], list):
             p[1].append(p[5])
             p[0] = p[1]
         else:
@@ -2090,8 +2377,6 @@ def p_term_spec(p: YaccProduction) -> None:
     | term_spec flexible_match_range_spec
     | term_spec forwarding_class_spec
     | term_spec forwarding_class_except_spec
-    | term_spec fragment_offset_spec
-    | term_spec hop_limit_spec
     | term_spec icmp_type_spec
     | term_spec icmp_code_spec
     | term_spec interface_spec
@@ -2102,7 +2387,7 @@ def p_term_spec(p: YaccProduction) -> None:
     | term_spec next_ip_spec
     | term_spec option_spec
     | term_spec owner_spec
-    | term_spec packet_length_spec
+    | term_spec range_spec
     | term_spec platform_spec
     | term_spec policer_spec
     | term_spec port_spec
@@ -2125,7 +2410,7 @@ def p_term_spec(p: YaccProduction) -> None:
     | term_spec vpn_spec
     |"""
     if len(p) > 1:
-        if type(p[1]) == Term:
+        if isinstance(p[1], Term):
             p[1].AddObject(p[2])
             p[0] = p[1]
         else:
@@ -2154,9 +2439,8 @@ def p_precedence_spec(p: YaccProduction) -> None:
 
 def p_flexible_match_range_spec(p):
     """flexible_match_range_spec : FLEXIBLE_MATCH_RANGE ':' ':' flex_match_key_values"""
-    p[0] = []
-    for kv in p[4]:
-        p[0].append(VarType(VarType.FLEXIBLE_MATCH_RANGE, kv))
+    var_type = VarType.FLEXIBLE_MATCH_RANGE
+    p[0] = [VarType(var_type, kv) for kv in p[4]]
 
 
 def p_flex_match_key_values(p):
@@ -2177,18 +2461,18 @@ def p_flex_match_key_values(p):
             raise FlexibleMatchError('%s value is not valid' % p[1])
     # per Juniper, max bit length is 32
     elif p[1] == 'bit-length':
-        if int(p[2]) not in list(range(33)):
+        if not 0 <= int(p[2]) <= 32:
             raise FlexibleMatchError('%s value is not valid' % p[1])
     # per Juniper, max bit offset is 7
     elif p[1] == 'bit-offset':
-        if int(p[2]) not in list(range(8)):
+        if not 0 <= int(p[2]) <= 7:
             raise FlexibleMatchError('%s value is not valid' % p[1])
     # per Juniper, offset can be up to 256 bytes
     elif p[1] == 'byte-offset':
-        if int(p[2]) not in list(range(256)):
+        if not 0 <= int(p[2]) <= 255:
             raise FlexibleMatchError('%s value is not valid' % p[1])
 
-    if type(p[0]) == type([]):
+    if isinstance(p[0], list):
         p[0].append([p.slice[1:]])
     else:
         p[0] = [[i.value for i in p.slice[1:]]]
@@ -2196,16 +2480,14 @@ def p_flex_match_key_values(p):
 
 def p_forwarding_class_spec(p: YaccProduction) -> None:
     """forwarding_class_spec : FORWARDING_CLASS ':' ':' one_or_more_strings"""
-    p[0] = []
-    for fclass in p[4]:
-        p[0].append(VarType(VarType.FORWARDING_CLASS, fclass))
+    var_type = VarType.FORWARDING_CLASS
+    p[0] = [VarType(var_type, fclass) for fclass in p[4]]
 
 
 def p_forwarding_class_except_spec(p):
     """forwarding_class_except_spec : FORWARDING_CLASS_EXCEPT ':' ':' one_or_more_strings"""
-    p[0] = []
-    for fclass in p[4]:
-        p[0].append(VarType(VarType.FORWARDING_CLASS_EXCEPT, fclass))
+    var_type = VarType.FORWARDING_CLASS_EXCEPT
+    p[0] = [VarType(var_type, fclass) for fclass in p[4]]
 
 
 def p_next_ip_spec(p: YaccProduction) -> None:
@@ -2238,31 +2520,17 @@ def p_priority_spec(p):
     p[0] = VarType(VarType.PRIORITY, p[4])
 
 
-def p_packet_length_spec(p):
-    """packet_length_spec : PACKET_LEN ':' ':' INTEGER
-    | PACKET_LEN ':' ':' INTEGER '-' INTEGER"""
-    if len(p) == 5:
-        p[0] = VarType(VarType.PACKET_LEN, str(p[4]))
-    else:
-        p[0] = VarType(VarType.PACKET_LEN, str(p[4]) + '-' + str(p[6]))
-
-
-def p_fragment_offset_spec(p):
-    """fragment_offset_spec : FRAGMENT_OFFSET ':' ':' INTEGER
-    | FRAGMENT_OFFSET ':' ':' INTEGER '-' INTEGER"""
-    if len(p) == 5:
-        p[0] = VarType(VarType.FRAGMENT_OFFSET, str(p[4]))
-    else:
-        p[0] = VarType(VarType.FRAGMENT_OFFSET, str(p[4]) + '-' + str(p[6]))
-
-
-def p_hop_limit_spec(p: YaccProduction) -> None:
-    """hop_limit_spec : HOP_LIMIT ':' ':' INTEGER
+def p_range_spec(p: YaccProduction) -> None:
+    """range_spec : PACKET_LEN ':' ':' INTEGER
+    | PACKET_LEN ':' ':' INTEGER '-' INTEGER
+    | FRAGMENT_OFFSET ':' ':' INTEGER
+    | FRAGMENT_OFFSET ':' ':' INTEGER '-' INTEGER
+    | HOP_LIMIT ':' ':' INTEGER
     | HOP_LIMIT ':' ':' INTEGER '-' INTEGER"""
     if len(p) == 5:
-        p[0] = VarType(VarType.HOP_LIMIT, str(p[4]))
+        p[0] = VarType(_KEYWORD_VAR_TYPES[p[1]], str(p[4]))
     else:
-        p[0] = VarType(VarType.HOP_LIMIT, str(p[4]) + '-' + str(p[6]))
+        p[0] = VarType(_KEYWORD_VAR_TYPES[p[1]], str(p[4]) + '-' + str(p[6]))
 
 
 def p_one_or_more_dscps(p):
@@ -2272,12 +2540,13 @@ def p_one_or_more_dscps(p):
     | DSCP_RANGE
     | DSCP
     | INTEGER"""
-    if len(p) > 1:
-        if type(p[1]) is list:
-            p[1].append(p[2])
-            p[0] = p[1]
-        else:
-            p[0] = [p[1]]
+    n = len(p)
+    if n == 3:
+        items = p[1]
+        items.append(p[2])
+        p[0] = items
+    elif n == 2:
+        p[0] = [p[1]]
 
 
 def p_dscp_set_spec(p):
@@ -2288,16 +2557,14 @@ def p_dscp_set_spec(p):
 
 def p_dscp_match_spec(p):
     """dscp_match_spec : DSCP_MATCH ':' ':' one_or_more_dscps"""
-    p[0] = []
-    for dscp in p[4]:
-        p[0].append(VarType(VarType.DSCP_MATCH, dscp))
+    var_type = VarType.DSCP_MATCH
+    p[0] = [VarType(var_type, dscp) for dscp in p[4]]
 
 
 def p_dscp_except_spec(p):
     """dscp_except_spec : DSCP_EXCEPT ':' ':' one_or_more_dscps"""
-    p[0] = []
-    for dscp in p[4]:
-        p[0].append(VarType(VarType.DSCP_EXCEPT, dscp))
+    var_type = VarType.DSCP_EXCEPT
+    p[0] = [VarType(var_type, dscp) for dscp in p[4]]
 
 
 def p_exclude_spec(p: YaccProduction) -> None:
@@ -2305,17 +2572,8 @@ def p_exclude_spec(p: YaccProduction) -> None:
     | DADDREXCLUDE ':' ':' one_or_more_strings
     | ADDREXCLUDE ':' ':' one_or_more_strings
     | PROTOCOL_EXCEPT ':' ':' one_or_more_strings"""
-
-    p[0] = []
-    for ex in p[4]:
-        if p[1].find('source-exclude') >= 0:
-            p[0].append(VarType(VarType.SADDREXCLUDE, ex))
-        elif p[1].find('destination-exclude') >= 0:
-            p[0].append(VarType(VarType.DADDREXCLUDE, ex))
-        elif p[1].find('address-exclude') >= 0:
-            p[0].append(VarType(VarType.ADDREXCLUDE, ex))
-        elif p[1].find('protocol-except') >= 0:
-            p[0].append(VarType(VarType.PROTOCOL_EXCEPT, ex))
+    var_type = _KEYWORD_VAR_TYPES[p[1]]
+    p[0] = [VarType(var_type, ex) for ex in p[4]]
 
 
 def p_prefix_list_spec(p: YaccProduction) -> None:
@@ -2323,90 +2581,61 @@ def p_prefix_list_spec(p: YaccProduction) -> None:
     | EDPFX ':' ':' one_or_more_strings
     | SPFX ':' ':' one_or_more_strings
     | ESPFX ':' ':' one_or_more_strings"""
-    p[0] = []
-    for pfx in p[4]:
-        if p[1].find('source-prefix-except') >= 0:
-            p[0].append(VarType(VarType.ESPFX, pfx))
-        elif p[1].find('source-prefix') >= 0:
-            p[0].append(VarType(VarType.SPFX, pfx))
-        elif p[1].find('destination-prefix-except') >= 0:
-            p[0].append(VarType(VarType.EDPFX, pfx))
-        elif p[1].find('destination-prefix') >= 0:
-            p[0].append(VarType(VarType.DPFX, pfx))
+    var_type = _KEYWORD_VAR_TYPES[p[1]]
+    p[0] = [VarType(var_type, pfx) for pfx in p[4]]
 
 
 def p_addr_spec(p: YaccProduction) -> None:
     """addr_spec : SADDR ':' ':' one_or_more_strings
     | DADDR ':' ':' one_or_more_strings
     | ADDR  ':' ':' one_or_more_strings"""
-    p[0] = []
-    for addr in p[4]:
-        if p[1].find('source-address') >= 0:
-            p[0].append(VarType(VarType.SADDRESS, addr))
-        elif p[1].find('destination-address') >= 0:
-            p[0].append(VarType(VarType.DADDRESS, addr))
-        else:
-            p[0].append(VarType(VarType.ADDRESS, addr))
+    var_type = _KEYWORD_VAR_TYPES[p[1]]
+    p[0] = [VarType(var_type, addr) for addr in p[4]]
 
 
 def p_port_spec(p: YaccProduction) -> None:
     """port_spec : SPORT ':' ':' one_or_more_strings
     | DPORT ':' ':' one_or_more_strings
     | PORT ':' ':' one_or_more_strings"""
-    p[0] = []
-    for port in p[4]:
-        if p[1].find('source-port') >= 0:
-            p[0].append(VarType(VarType.SPORT, port))
-        elif p[1].find('destination-port') >= 0:
-            p[0].append(VarType(VarType.DPORT, port))
-        else:
-            p[0].append(VarType(VarType.PORT, port))
+    var_type = _KEYWORD_VAR_TYPES[p[1]]
+    p[0] = [VarType(var_type, port) for port in p[4]]
 
 
 def p_protocol_spec(p: YaccProduction) -> None:
     """protocol_spec : PROTOCOL ':' ':' strings_or_ints"""
-    p[0] = []
-    for proto in p[4]:
-        p[0].append(VarType(VarType.PROTOCOL, proto))
+    var_type = VarType.PROTOCOL
+    p[0] = [VarType(var_type, proto) for proto in p[4]]
 
 
 def p_tag_list_spec(p: YaccProduction) -> None:
     """tag_list_spec : DTAG ':' ':' one_or_more_strings
     | STAG ':' ':' one_or_more_strings"""
-    p[0] = []
-    for tag in p[4]:
-        if p[1].find('source-tag') >= 0:
-            p[0].append(VarType(VarType.STAG, tag))
-        elif p[1].find('destination-tag') >= 0:
-            p[0].append(VarType(VarType.DTAG, tag))
+    var_type = _KEYWORD_VAR_TYPES[p[1]]
+    p[0] = [VarType(var_type, tag) for tag in p[4]]
 
 
 def p_target_resources_spec(p: YaccProduction) -> None:
     """target_resources_spec : TARGET_RESOURCES ':' ':' one_or_more_tuples"""
-    p[0] = []
-    for target_resource in p[4]:
-        p[0].append(VarType(VarType.TARGET_RESOURCES, target_resource))
+    var_type = VarType.TARGET_RESOURCES
+    p[0] = [VarType(var_type, target_resource) for target_resource in p[4]]
 
 
 def p_target_service_accounts_spec(p: YaccProduction) -> None:
     """target_service_accounts_spec : TARGET_SERVICE_ACCOUNTS ':' ':' one_or_more_strings"""
-    p[0] = []
-    for service_account in p[4]:
-        p[0].append(VarType(VarType.TARGET_SERVICE_ACCOUNTS, service_account))
+    var_type = VarType.TARGET_SERVICE_ACCOUNTS
+    p[0] = [VarType(var_type, service_account) for service_account in p[4]]
 
 
 def p_ether_type_spec(p: YaccProduction) -> None:
     """ether_type_spec : ETHER_TYPE ':' ':' one_or_more_strings"""
-    p[0] = []
-    for proto in p[4]:
-        p[0].append(VarType(VarType.ETHER_TYPE, proto))
+    var_type = VarType.ETHER_TYPE
+    p[0] = [VarType(var_type, proto) for proto in p[4]]
 
 
 def p_traffic_type_spec(p: YaccProduction) -> None:
     """traffic_type_spec : TRAFFIC_TYPE ':' ':' one_or_more_strings"""
-    p[0] = []
-    for proto in p[4]:
-        p[0].append(VarType(VarType.TRAFFIC_TYPE, proto))
+    var_type = VarType.TRAFFIC_TYPE
+    p[0] = [VarType(var_type, proto) for proto in p[4]]
 
 
 def p_policer_spec(p):
@@ -2431,9 +2660,8 @@ def p_log_name_spec(p: YaccProduction) -> None:
 
 def p_option_spec(p: YaccProduction) -> None:
     """option_spec : OPTION ':' ':' one_or_more_strings"""
-    p[0] = []
-    for opt in p[4]:
-        p[0].append(VarType(VarType.OPTION, opt))
+    var_type = VarType.OPTION
+    p[0] = [VarType(var_type, opt) for opt in p[4]]
 
 
 def p_action_spec(p: YaccProduction) -> None:
@@ -2469,18 +2697,15 @@ def p_owner_spec(p):
 def p_verbatim_spec(p: YaccProduction) -> None:
     """verbatim_spec : VERBATIM ':' ':' STRING DQUOTEDSTRING
     | VERBATIM ':' ':' STRING ESCAPEDSTRING"""
-    p[0] = VarType(VarType.VERBATIM, [p[4], p[5].strip('"').replace('\\"', '"')])
+    # drop the enclosing quotes only; the text may itself end in an escaped quote.
+    p[0] = VarType(VarType.VERBATIM, [p[4], p[5][1:-1].replace('\\"', '"')])
 
 
 def p_term_zone_spec(p: YaccProduction) -> None:
     """term_zone_spec : SZONE ':' ':' one_or_more_strings
     | DZONE ':' ':' one_or_more_strings"""
-    p[0] = []
-    for zone in p[4]:
-        if p[1].find('source-zone') >= 0:
-            p[0].append(VarType(VarType.SZONE, zone))
-        elif p[1].find('destination-zone') >= 0:
-            p[0].append(VarType(VarType.DZONE, zone))
+    var_type = _KEYWORD_VAR_TYPES[p[1]]
+    p[0] = [VarType(var_type, zone) for zone in p[4]]
 
 
 def p_vpn_spec(p: YaccProduction) -> None:
@@ -2499,43 +2724,33 @@ def p_qos_spec(p: YaccProduction) -> None:
 
 def p_pan_application_spec(p):
     """pan_application_spec : PAN_APPLICATION ':' ':' one_or_more_strings"""
-    p[0] = []
-    for apps in p[4]:
-        p[0].append(VarType(VarType.PAN_APPLICATION, apps))
+    var_type = VarType.PAN_APPLICATION
+    p[0] = [VarType(var_type, apps) for apps in p[4]]
 
 
 def p_interface_spec(p: YaccProduction) -> None:
     """interface_spec : SINTERFACE ':' ':' STRING
     | DINTERFACE ':' ':' STRING"""
-    if p[1].find('source-interface') >= 0:
-        p[0] = VarType(VarType.SINTERFACE, p[4])
-    elif p[1].find('destination-interface') >= 0:
-        p[0] = VarType(VarType.DINTERFACE, p[4])
+    p[0] = VarType(_KEYWORD_VAR_TYPES[p[1]], p[4])
 
 
 def p_platform_spec(p):
     """platform_spec : PLATFORM ':' ':' one_or_more_strings
     | PLATFORMEXCLUDE ':' ':' one_or_more_strings"""
-    p[0] = []
-    for platform in p[4]:
-        if p[1].find('platform-exclude') >= 0:
-            p[0].append(VarType(VarType.PLATFORMEXCLUDE, platform))
-        elif p[1].find('platform') >= 0:
-            p[0].append(VarType(VarType.PLATFORM, platform))
+    var_type = _KEYWORD_VAR_TYPES[p[1]]
+    p[0] = [VarType(var_type, platform) for platform in p[4]]
 
 
 def p_apply_groups_spec(p):
     """apply_groups_spec : APPLY_GROUPS ':' ':' one_or_more_strings"""
-    p[0] = []
-    for group in p[4]:
-        p[0].append(VarType(VarType.APPLY_GROUPS, group))
+    var_type = VarType.APPLY_GROUPS
+    p[0] = [VarType(var_type, group) for group in p[4]]
 
 
 def p_apply_groups_except_spec(p):
     """apply_groups_except_spec : APPLY_GROUPS_EXCEPT ':' ':' one_or_more_strings"""
-    p[0] = []
-    for group_except in p[4]:
-        p[0].append(VarType(VarType.APPLY_GROUPS_EXCEPT, group_except))
+    var_type = VarType.APPLY_GROUPS_EXCEPT
+    p[0] = [VarType(var_type, group_except) for group_except in p[4]]
 
 
 def p_timeout_spec(p):
@@ -2557,12 +2772,13 @@ def p_one_or_more_strings(p: YaccProduction) -> None:
     """one_or_more_strings : one_or_more_strings STRING
     | STRING
     |"""
-    if len(p) > 1:
-        if type(p[1]) == type([]):
-            p[1].append(p[2])
-            p[0] = p[1]
-        else:
-            p[0] = [p[1]]
+    n = len(p)
+    if n == 3:
+        items = p[1]
+        items.append(p[2])
+        p[0] = items
+    elif n == 2:
+        p[0] = [p[1]]
 
 
 def p_one_or_more_tuples(p: YaccProduction) -> None:
@@ -2573,16 +2789,17 @@ def p_one_or_more_tuples(p: YaccProduction) -> None:
     |"""
 
     if len(p) > 1:
-        if p[1] == '[':
+        items = p[1]
+        if items == '[':
             p[0] = p[2]
-        elif type(p[1]) == type([]):
+        elif isinstance(items, list):
             if p[2] == ',':
-                p[1].append(p[3])
+                items.append(p[3])
             else:
-                p[1].append(p[2])
-            p[0] = p[1]
+                items.append(p[2])
+            p[0] = items
         else:
-            p[0] = [p[1]]
+            p[0] = [items]
 
 
 def p_one_tuple(p: YaccProduction) -> None:
@@ -2595,12 +2812,13 @@ def p_one_or_more_ints(p: YaccProduction) -> None:
     """one_or_more_ints : one_or_more_ints INTEGER
     | INTEGER
     |"""
-    if len(p) > 1:
-        if type(p[1]) == type([]):
-            p[1].append(int(p[2]))
-            p[0] = p[1]
-        else:
-            p[0] = [int(p[1])]
+    n = len(p)
+    if n == 3:
+        items = p[1]
+        items.append(int(p[2]))
+        p[0] = items
+    elif n == 2:
+        p[0] = [int(p[1])]
 
 
 def p_strings_or_ints(p: YaccProduction) -> None:
@@ -2609,24 +2827,23 @@ def p_strings_or_ints(p: YaccProduction) -> None:
     | STRING
     | INTEGER
     |"""
-    if len(p) > 1:
-        if type(p[1]) is list:
-            p[1].append(p[2])
-            p[0] = p[1]
-        else:
-            p[0] = [p[1]]
+    n = len(p)
+    if n == 3:
+        items = p[1]
+        items.append(p[2])
+        p[0] = items
+    elif n == 2:
+        p[0] = [p[1]]
 
 
 def p_error(p: LexToken):
     """."""
-    global parser
-    next_token = parser.token()
-    if next_token is None:
-        use_token = 'EOF'
-    else:
-        use_token = repr(next_token.value)
-
     if p:
+        next_token = parser.token()
+        if next_token is None:
+            use_token = 'EOF'
+        else:
+            use_token = repr(next_token.value)
         raise ParseError(
             ' ERROR on "%s" (type %s, line %d, Next %s)' % (p.value, p.type, p.lineno, use_token)
         )
@@ -2634,7 +2851,48 @@ def p_error(p: LexToken):
         raise ParseError(' ERROR you likely have unablanaced "{"\'s')
 
 
-parser = yacc.yacc(write_tables=False, debug=0, errorlog=yacc.NullLogger())
+def _GrammarSignature() -> str:
+    """Returns the yacc signature of the grammar defined in this module."""
+    pinfo = yacc.ParserReflect(dict(vars(sys.modules[__name__])))
+    pinfo.get_all()
+    return pinfo.signature()
+
+
+def _BuildParser(write_tables: bool = False) -> yacc.LRParser:
+    """Build the policy parser, loading the shipped LALR tables when current.
+
+    The pickled tables in _PARSER_TABLES are only trusted if their signature
+    matches the grammar defined in this module. Stale or missing tables are
+    regenerated in memory, and written back out when write_tables is True.
+
+    Args:
+      write_tables: bool - whether to write regenerated tables to disk.
+
+    Returns:
+      The constructed parser.
+    """
+    if not write_tables:
+        lr = yacc.LRTable()
+        try:
+            signature = lr.read_pickle(_PARSER_TABLES)
+        except (ImportError, EOFError, pickle.UnpicklingError, yacc.VersionError):
+            signature = None
+        if signature == _GrammarSignature():
+            lr.bind_callables(vars(sys.modules[__name__]))
+            return yacc.LRParser(lr, p_error)
+
+    return yacc.yacc(
+        module=sys.modules[__name__],
+        picklefile=_PARSER_TABLES if write_tables else None,
+        write_tables=False,
+        debug=0,
+        errorlog=yacc.NullLogger(),
+    )
+
+
+parser = _BuildParser()
+# Each parse works on a fresh clone of the lexer.
+lexer = _Lexer()
 
 # pylint: enable=unused-argument,invalid-name,g-short-docstring-punctuation
 # pylint: enable=g-docstring-quotes,g-short-docstring-space
@@ -2668,7 +2926,13 @@ def _ReadFile(filename):
         raise FileNotFoundError('Unable to open policy file %s' % filename)
 
 
-def _Preprocess(data: str, max_depth: int = 5, base_dir: str = '') -> List[str]:
+def _Preprocess(
+    data: str,
+    max_depth: int = 5,
+    base_dir: str = '',
+    include_cache: Optional[Dict[str, str]] = None,
+    resolved_base_dir: Optional[str] = None,
+) -> List[str]:
     """Search input for include statements and import specified include file.
 
     Search input for include statements and if found, import specified file
@@ -2678,6 +2942,9 @@ def _Preprocess(data: str, max_depth: int = 5, base_dir: str = '') -> List[str]:
       data: A string of Policy file data.
       max_depth: Maximum depth of included files
       base_dir: Base path string where to look for policy or include files
+      include_cache: Contents of include files already read during this parse,
+        keyed by path, so that a file included repeatedly is only read once.
+      resolved_base_dir: base_dir with symlinks resolved, computed once per parse.
 
     Returns:
       A string containing result of the processed input data
@@ -2689,8 +2956,18 @@ def _Preprocess(data: str, max_depth: int = 5, base_dir: str = '') -> List[str]:
         raise RecursionTooDeepError(
             '%s' % ('Included files exceed maximum recursion depth of %s.' % max_depth)
         )
+    lines = [x.rstrip() for x in data.splitlines()]
+    if '#include' not in data:
+        return lines
+    if include_cache is None:
+        include_cache = {}
+    if resolved_base_dir is None:
+        resolved_base_dir = os.path.realpath(base_dir)
     rval = []
-    for line in [x.rstrip() for x in data.splitlines()]:
+    for line in lines:
+        if '#include' not in line:
+            rval.append(line)
+            continue
         words = line.split()
         if len(words) > 1 and words[0] == '#include':
             # remove any quotes around included filename
@@ -2702,14 +2979,22 @@ def _Preprocess(data: str, max_depth: int = 5, base_dir: str = '') -> List[str]:
                     f"Include file name must end in \".inc\". File={include_path} base_directory={base_dir}"
                 )
 
-            if not _SubpathOf(base_dir, include_path):
+            if not _ResolvedSubpathOf(resolved_base_dir, include_path):
                 raise BadIncludePath(
                     f"Include file cannot be loaded from outside the base directory. File={include_path} base_directory={base_dir}"
                 )
 
-            data = _ReadFile(include_path)
+            data = include_cache.get(include_path)
+            if data is None:
+                data = include_cache[include_path] = _ReadFile(include_path)
             # recursively handle includes in included data
-            inc_data = _Preprocess(data, max_depth - 1, base_dir=base_dir)
+            inc_data = _Preprocess(
+                data,
+                max_depth - 1,
+                base_dir=base_dir,
+                include_cache=include_cache,
+                resolved_base_dir=resolved_base_dir,
+            )
             rval.extend(inc_data)
         else:
             rval.append(line)
@@ -2717,7 +3002,13 @@ def _Preprocess(data: str, max_depth: int = 5, base_dir: str = '') -> List[str]:
 
 
 def _SubpathOf(parent: str, subpath: Union[str, pathlib.PosixPath]) -> bool:
-    return str(pathlib.Path(subpath).resolve()).startswith(str(pathlib.Path(parent).resolve()))
+    return _ResolvedSubpathOf(os.path.realpath(parent), subpath)
+
+
+def _ResolvedSubpathOf(resolved_parent: str, subpath: Union[str, pathlib.PosixPath]) -> bool:
+    """Check whether subpath lies under a parent directory that is already resolved."""
+    resolved_subpath = os.path.realpath(subpath)
+    return os.path.commonpath([resolved_parent, resolved_subpath]) == resolved_parent
 
 
 def ParseFile(filename, definitions=None, optimize=True, base_dir='', shade_check=False):
@@ -2766,18 +3057,17 @@ def ParsePolicy(
       policy object or False (if parse error).
     """
     try:
-        if definitions:
-            globals()['DEFINITIONS'] = definitions
-        else:
-            globals()['DEFINITIONS'] = naming.Naming(DEFAULT_DEFINITIONS)
+        _SetDefinitions(definitions)
         globals()['_OPTIMIZE'] = optimize
         globals()['_SHADE_CHECK'] = shade_check
 
-        lexer = lex.lex()
-
         preprocessed_data = '\n'.join(_Preprocess(data, base_dir=base_dir))
-        global parser
-        policy = parser.parse(preprocessed_data, lexer=lexer)
+        global parser, _NET_ADDR_CACHE
+        _NET_ADDR_CACHE = {}
+        try:
+            policy = parser.parse(preprocessed_data, lexer=lexer.clone())
+        finally:
+            _NET_ADDR_CACHE = None
         policy.filename = filename
         return policy
 
@@ -2787,14 +3077,16 @@ def ParsePolicy(
 
 def FromBuilder(builder: PolicyBuilder) -> Policy:
     """Construct and return a Policy model instance from a PolicyBuilder."""
-    if builder.definitions:
-        globals()['DEFINITIONS'] = builder.definitions
-    else:
-        globals()['DEFINITIONS'] = naming.Naming(DEFAULT_DEFINITIONS)
+    _SetDefinitions(builder.definitions)
     globals()['_OPTIMIZE'] = builder.optimize
     globals()['_SHADE_CHECK'] = builder.shade_check
 
-    return builder.BuildPolicy()
+    global _NET_ADDR_CACHE
+    _NET_ADDR_CACHE = {}
+    try:
+        return builder.BuildPolicy()
+    finally:
+        _NET_ADDR_CACHE = None
 
 
 # if you call this from the command line, you can specify a pol file for it to
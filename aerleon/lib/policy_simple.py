@@ -36,12 +36,7 @@ class Field:
         self.value = value
 
     def __str__(self) -> str:
-        t = type(self)
-        f = 'UNKNOWN'
-        for k, v in field_map.items():
-            if t == v:
-                f = k
-                break
+        f = _FIELD_NAMES.get(type(self), 'UNKNOWN')
         indent = len(f) + 5
         return '%s::%s' % (f, self.ValueStr().replace('\n', '\n' + ' ' * indent))
 
@@ -390,6 +385,7 @@ field_map = {
     'vpn': Vpn,
     'encapsulate': Encapsulate,
 }
+_FIELD_NAMES = {v: k for k, v in field_map.items()}
 
 
 class Block:
@@ -405,21 +401,12 @@ class Block:
         return self.fields[i]
 
     def __str__(self) -> str:
-        buf = []
-        buf.append(type(self).__name__.lower())
-        buf.append(' ')
-        if self.Name():
-            buf.append(self.Name())
-            buf.append(' ')
-        buf.append('{')  # }
-        buf.append('\n')
-        for field in self.fields:
-            buf.append('  ')
-            buf.append(str(field))
-            buf.append('\n')
-        buf.append('}')
-        buf.append('\n')
-        return ''.join(buf)
+        name = self.Name()
+        if name:
+            opening = '%s %s {\n' % (type(self).__name__.lower(), name)  # }
+        else:
+            opening = '%s {\n' % type(self).__name__.lower()  # }
+        return ''.join([opening, *['  %s\n' % field for field in self.fields], '}\n'])
 
     def AddField(self, field) -> None:
         if not issubclass(type(field), Field):
@@ -1,4 +1,8 @@
-from yaml.loader import SafeLoader
+try:
+    # libyaml-backed loader, when PyYAML was built with it.
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml.loader import SafeLoader
 
 
 def SpanSafeYamlLoader(*, filename):
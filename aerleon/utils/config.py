@@ -6,6 +6,8 @@ import pathlib
 
 import yaml
 
+from aerleon.lib.yaml_loader import SafeLoader
+
 defaults = {
     'base_directory': './policies',
     'definitions_directory': './def',
@@ -65,7 +67,7 @@ def load_config(
 
         try:
             with open(config, 'r') as f:
-                data = yaml.safe_load(f)
+                data = yaml.load(f, Loader=SafeLoader)
 
                 if not data or not isinstance(data, dict):
                     raise ConfigFileError(f"Config file contents not valid: {config}")
@@ -85,6 +85,17 @@ def benchmark_tuned(session):
     session.notify('benchmark', ['__benchmark_tune'])
 
 
+@session
+def parser_tables(session):
+    """Regenerates the PLY parser tables shipped in aerleon/lib/_parser_tables"""
+    session.run_always("poetry", "install", external=True)
+    session.run(
+        "python",
+        "-c",
+        "from aerleon.lib import policy; policy._BuildParser(write_tables=True)",
+    )
+
+
 @session
 def format(session):
     """Runs black and isort"""
@@ -331,7 +331,7 @@ class TermTest(absltest.TestCase):
         self.assertEqual(rule, UDP_RULE)
 
         self.naming.GetNetAddr.assert_has_calls([mock.call('NTP_SERVERS'), mock.call('INTERNAL')])
-        self.naming.GetServiceByProto.assert_has_calls([mock.call('NTP', 'udp')] * 2)
+        self.naming.GetServiceByProto.assert_called_once_with('NTP', 'udp')
 
     def test_icmpv6_term(self):
         """Test __init__ and __str__ for term inet6."""
@@ -362,7 +362,7 @@ class TermTest(absltest.TestCase):
 
         self.assertEqual(api_policy, UDP_NSXT_POLICY)
         self.naming.GetNetAddr.assert_has_calls([mock.call('NTP_SERVERS'), mock.call('INTERNAL')])
-        self.naming.GetServiceByProto.assert_has_calls([mock.call('NTP', 'udp')] * 2)
+        self.naming.GetServiceByProto.assert_called_once_with('NTP', 'udp')
 
     def test_udp_and_tcp_policy(self):
         """Test for Nsxt._str_."""
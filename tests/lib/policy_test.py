@@ -19,6 +19,7 @@ from unittest import mock
 
 from absl import logging
 from absl.testing import absltest, parameterized
+from ply import yacc
 
 from aerleon.lib import nacaddr, naming, policy
 from aerleon.lib import yaml as yaml_frontend
@@ -622,6 +623,19 @@ class PolicyTest(parameterized.TestCase):
 
         mock_file.assert_has_calls([mock.call('/tmp/y.inc'), mock.call('/tmp/z.inc')])
 
+    @mock.patch.object(policy, '_ReadFile')
+    def testRepeatedIncludeReadOnce(self, mock_file):
+        """Ensure a file included more than once is only read once per parse."""
+        mock_file.return_value = GOOD_TERM_5
+        data = policy._Preprocess(INCLUDE_STATEMENT * 2, base_dir='/tmp')
+        self.assertEqual(data.count('term good-term-5 {'), 2)
+        mock_file.assert_called_once_with('/tmp/y.inc')
+
+    def testParserTablesCurrent(self):
+        """Ensure the shipped parser tables match the grammar (run `nox -s parser_tables`)."""
+        signature = yacc.LRTable().read_pickle(policy._PARSER_TABLES)
+        self.assertEqual(policy._GrammarSignature(), signature)
+
     def testBadIncludePaths(self):
         """Watch for includes outside of the base_dir or with the incorrect suffix."""
         pol = HEADER + INCLUDE_STATEMENT + GOOD_TERM_1
@@ -632,6 +646,16 @@ class PolicyTest(parameterized.TestCase):
         self.assertRaises(
             policy.BadIncludePath, policy.ParsePolicy, pol, self.naming, base_dir='/tmp'
         )
+        pol = HEADER + INCLUDE_STATEMENT + GOOD_TERM_1
+        self.assertRaises(
+            policy.BadIncludePath, policy.ParsePolicy, pol, self.naming, base_dir='/tm'
+        )
+
+    def testSubpathOf(self):
+        self.assertTrue(policy._SubpathOf('/tmp', '/tmp/y.inc'))
+        self.assertTrue(policy._SubpathOf('/tmp/', '/tmp/a/../y.inc'))
+        self.assertFalse(policy._SubpathOf('/tmp/a', '/tmp/ab/y.inc'))
+        self.assertFalse(policy._SubpathOf('/tmp/a', '/tmp/a/../y.inc'))
 
     def testGoodPol(self):
         pol = HEADER + GOOD_TERM_1 + GOOD_TERM_2
@@ -744,6 +768,26 @@ class PolicyTest(parameterized.TestCase):
             [mock.call('DNS', 'tcp'), mock.call('DNS', 'udp')], any_order=True
         )
 
+    def testCollapsePortList(self):
+        term = policy.Term([])
+        self.assertEqual(
+            term.CollapsePortList([(22, 30), (10, 20), (12, 13), (20, 25), (40, 40), (31, 35)]),
+            [(10, 35), (40, 40)],
+        )
+        self.assertEqual(term.CollapsePortList([(80, 80), (80, 80)]), [(80, 80)])
+        self.assertEqual(term.CollapsePortList([]), [])
+
+    def testTermEqualityIgnoresRepeatedValues(self):
+        term = policy.Term([])
+        term.protocol = ['tcp', 'udp', 'tcp']
+        term.option = ['established']
+        other = policy.Term([])
+        other.protocol = ['udp', 'tcp']
+        other.option = ['established', 'established']
+        self.assertEqual(term, other)
+        other.option = ['tcp-established']
+        self.assertNotEqual(term, other)
+
     def testMinimumTerm2(self):
         pol = HEADER + GOOD_TERM_9
         ret = policy.ParsePolicy(pol, self.naming)
@@ -759,6 +803,67 @@ class PolicyTest(parameterized.TestCase):
         _, terms = ret.filters[0]
         self.assertEqual(str(terms[0].log_name), 'my special prefix')
 
+    @mock.patch.object(policy.logging, 'warning')
+    def testUndefinedServiceWarnedOncePerTerm(self, mock_warning):
+        pol = HEADER + (
+            'term dns-term {\n'
+            '  protocol:: tcp udp\n'
+            '  source-port:: DNS\n'
+            '  destination-port:: DNS\n'
+            '  action:: accept\n'
+            '}\n'
+        )
+        self.naming.GetServiceByProto.side_effect = lambda port, proto: (
+            ['53'] if proto == 'udp' else []
+        )
+        ret = policy.ParsePolicy(pol, self.naming)
+        self.assertEqual(ret.filters[0][1][0].destination_port, [(53, 53)])
+        mock_warning.assert_called_once_with(mock.ANY, 'dns-term', 'DNS', 'tcp')
+
+    def testNetworkLookupsCopiedPerTerm(self):
+        pol = HEADER + GOOD_TERM_2 + GOOD_TERM_3
+        self.naming.GetNetAddr.return_value = [nacaddr.IPv4('10.0.0.0/8')]
+        self.naming.GetServiceByProto.return_value = ['25']
+        ret = policy.ParsePolicy(pol, self.naming)
+        _, terms = ret.filters[0]
+        self.assertEqual(terms[0].source_address, terms[1].source_address)
+        self.assertIsNot(terms[0].source_address[0], terms[1].source_address[0])
+        self.naming.GetNetAddr.assert_called_once_with('PROD_NETWRK')
+
+    def testRepeatedNetworkTokensDeduplicated(self):
+        pol = HEADER + GOOD_TERM_2.replace('PROD_NETWRK', 'PROD_NETWRK PROD_NETWRK CORP_NETWRK')
+        self.naming.GetNetAddr.side_effect = [
+            [nacaddr.IPv4('10.0.0.0/8', token='PROD_NETWRK')],
+            [nacaddr.IPv4('10.0.0.0/8', token='CORP_NETWRK')],
+        ]
+        ret = policy.ParsePolicy(pol, self.naming, optimize=False)
+        _, terms = ret.filters[0]
+        self.assertEqual(
+            [x.token for x in terms[0].source_address], ['PROD_NETWRK', 'CORP_NETWRK']
+        )
+
+    def testRepeatedNetworkTokensAcrossLinesDeduplicated(self):
+        pol = HEADER + GOOD_TERM_2.replace(
+            'source-address:: PROD_NETWRK',
+            'source-address:: PROD_NETWRK\n  source-address:: PROD_NETWRK',
+        )
+        self.naming.GetNetAddr.return_value = [nacaddr.IPv4('10.0.0.0/8', token='PROD_NETWRK')]
+        ret = policy.ParsePolicy(pol, self.naming, optimize=False)
+        _, terms = ret.filters[0]
+        self.assertEqual(terms[0].source_address, [nacaddr.IPv4('10.0.0.0/8')])
+
+    def testServiceLookupsResetBetweenParses(self):
+        pol = HEADER + GOOD_TERM_3
+        self.naming.GetNetAddr.return_value = [nacaddr.IPv4('10.0.0.0/8')]
+        self.naming.GetServiceByProto.return_value = ['25']
+        ret = policy.ParsePolicy(pol, self.naming)
+        self.assertEqual(ret.filters[0][1][0].destination_port, [(25, 25)])
+
+        self.naming.GetServiceByProto.return_value = ['587']
+        ret = policy.ParsePolicy(pol, self.naming)
+        self.assertEqual(ret.filters[0][1][0].destination_port, [(587, 587)])
+        self.assertEqual(self.naming.GetServiceByProto.call_count, 2)
+
     def testTermEquality(self):
         self.naming.GetNetAddr.side_effect = [
             [
@@ -770,29 +875,8 @@ class PolicyTest(parameterized.TestCase):
                 nacaddr.IPv4('216.239.32.0/19'),
             ],
             [nacaddr.IPv4('10.0.0.0/8')],
-            [nacaddr.IPv4('10.0.0.0/8')],
-            [
-                nacaddr.IPv4('64.233.160.0/19'),
-                nacaddr.IPv4('66.102.0.0/20'),
-                nacaddr.IPv4('66.249.80.0/20'),
-                nacaddr.IPv4('72.14.192.0/18'),
-                nacaddr.IPv4('72.14.224.0/20'),
-                nacaddr.IPv4('216.239.32.0/19'),
-            ],
-            [nacaddr.IPv4('10.0.0.0/8')],
-            [
-                nacaddr.IPv4('64.233.160.0/19'),
-                nacaddr.IPv4('66.102.0.0/20'),
-                nacaddr.IPv4('66.249.80.0/20'),
-                nacaddr.IPv4('72.14.192.0/18'),
-                nacaddr.IPv4('72.14.224.0/20'),
-                nacaddr.IPv4('216.239.32.0/19'),
-            ],
         ]
         self.naming.GetServiceByProto.side_effect = [
-            ['80'],
-            ['3306'],
-            ['3306'],
             ['80'],
             ['3306'],
             ['443'],
@@ -807,26 +891,14 @@ class PolicyTest(parameterized.TestCase):
         self.assertNotEqual(terms[0], terms[2])
 
         self.naming.GetNetAddr.assert_has_calls(
-            [
-                mock.call('PROD_EXTERNAL_SUPER'),
-                mock.call('PROD_NETWRK'),
-                mock.call('PROD_NETWRK'),
-                mock.call('PROD_EXTERNAL_SUPER'),
-                mock.call('PROD_NETWRK'),
-                mock.call('PROD_EXTERNAL_SUPER'),
-            ],
-            any_order=True,
+            [mock.call('PROD_EXTERNAL_SUPER'), mock.call('PROD_NETWRK')]
         )
         self.naming.GetServiceByProto.assert_has_calls(
             [
-                mock.call('HTTP', 'tcp'),
-                mock.call('MYSQL', 'tcp'),
-                mock.call('MYSQL', 'tcp'),
                 mock.call('HTTP', 'tcp'),
                 mock.call('MYSQL', 'tcp'),
                 mock.call('HTTPS', 'tcp'),
-            ],
-            any_order=True,
+            ]
         )
 
     def testGoodDestAddrExcludes(self):
@@ -950,6 +1022,24 @@ class PolicyTest(parameterized.TestCase):
             [mock.call('PROD_NETWRK'), mock.call('PROD_EH')], any_order=True
         )
 
+    def testGoodAddrExcludesFlattenMixedFamilies(self):
+        pol = HEADER + GOOD_TERM_27
+        self.naming.GetNetAddr.side_effect = [
+            [
+                nacaddr.IPv6('2001:db8::/32'),
+                nacaddr.IPv4('10.1.0.0/16'),
+                nacaddr.IPv4('10.2.0.0/16'),
+            ],
+            [nacaddr.IPv4('10.2.0.0/15')],
+        ]
+
+        ret = policy.ParsePolicy(pol, self.naming)
+        _, terms = ret.filters[0]
+        terms[0].FlattenAll()
+        self.assertEqual(
+            terms[0].address, [nacaddr.IPv4('10.1.0.0/16'), nacaddr.IPv6('2001:db8::/32')]
+        )
+
     def testLogging(self):
         pol = HEADER + GOOD_TERM_10
         ret = policy.ParsePolicy(pol, self.naming)
@@ -1110,6 +1200,14 @@ class PolicyTest(parameterized.TestCase):
         self.assertEqual(terms[0].verbatim[1][0], 'juniper')
         self.assertEqual(terms[0].verbatim[1][1], 'mary had another lamb')
 
+    def testVerbatimEscapedQuotes(self):
+        pol = policy.ParsePolicy(
+            HEADER + GOOD_TERM_18.replace('"mary had another lamb"', r'"say \"baa\""'),
+            self.naming,
+        )
+        _, terms = pol.filters[0]
+        self.assertEqual(terms[0].verbatim[1][1], 'say "baa"')
+
     def testVerbatimMixed(self):
         pol = HEADER + BAD_TERM_10
         self.assertRaises(policy.ParseError, policy.ParsePolicy, pol, self.naming)
@@ -1157,25 +1255,99 @@ class PolicyTest(parameterized.TestCase):
 
         self.naming.GetServiceByProto.assert_called_once_with('SSH', 'tcp')
 
+    def testCheckPortIsContained(self):
+        term = policy.Term([])
+        superset = [(1, 10), (100, 200), (150, 160), (20, 30), (1024, 65535)]
+        self.assertTrue(term.CheckPortIsContained(superset, [(5, 10), (155, 199), (2000, 2000)]))
+        self.assertFalse(term.CheckPortIsContained(superset, [(5, 11)]))
+        self.assertFalse(term.CheckPortIsContained(superset, [(0, 0)]))
+        self.assertFalse(term.CheckPortIsContained(superset[:2], [(50, 60)]))
+        self.assertTrue(term.CheckPortIsContained([], [(50, 60)]))
+        self.assertFalse(term.CheckPortIsContained(superset, []))
+
+    def testCheckAddressIsContained(self):
+        term = policy.Term([])
+        superset = [nacaddr.IP('10.%d.0.0/16' % i) for i in range(8)]
+        superset.extend([nacaddr.IP('10.0.0.0/8'), nacaddr.IP('2001:db8::/32')])
+        self.assertTrue(
+            term.CheckAddressIsContained(
+                superset,
+                [
+                    nacaddr.IP('10.200.1.0/24'),
+                    nacaddr.IP('10.3.0.0/16'),
+                    nacaddr.IP('2001:db8::/64'),
+                ],
+            )
+        )
+        self.assertFalse(term.CheckAddressIsContained(superset, [nacaddr.IP('11.0.0.0/24')]))
+        self.assertFalse(term.CheckAddressIsContained(superset, [nacaddr.IP('2001:db9::/64')]))
+        self.assertFalse(term.CheckAddressIsContained(superset[:8], [nacaddr.IP('10.0.0.0/8')]))
+        self.assertFalse(term.CheckAddressIsContained(superset[:8], [nacaddr.IP('::/0')]))
+
     @mock.patch.object(policy.logging, "warning")
     def testShadingDetection(self, mock_logger):
         pol2 = HEADER + GOOD_TERM_2 + GOOD_TERM_3
-        self.naming.GetNetAddr.side_effect = [
-            [nacaddr.IPv4('10.0.0.0/8')],
-            [nacaddr.IPv4('10.0.0.0/8')],
-        ]
+        self.naming.GetNetAddr.return_value = [nacaddr.IPv4('10.0.0.0/8')]
         self.naming.GetServiceByProto.return_value = ['25']
 
         # same protocol, same saddr, shaded term defines a port.
         policy.ParsePolicy(pol2, self.naming, shade_check=True)
 
-        self.naming.GetNetAddr.assert_has_calls(
-            [mock.call('PROD_NETWRK'), mock.call('PROD_NETWRK')]
-        )
-        mock_logger.assert_called_with('good-term-3 is shaded by good-term-2')
+        self.naming.GetNetAddr.assert_called_once_with('PROD_NETWRK')
+        mock_logger.assert_called_with('%s is shaded by %s', 'good-term-3', 'good-term-2')
 
         self.naming.GetServiceByProto.assert_called_once_with('SMTP', 'tcp')
 
+    @mock.patch.object(policy.logging, "warning")
+    def testShadingDetectionIcmpType(self, mock_logger):
+        shaded = TERM_UNSORTED_ICMP_TYPE.replace('good-term-11', 'shaded-term')
+        policy.ParsePolicy(
+            HEADER + TERM_UNSORTED_ICMP_TYPE + shaded, self.naming, shade_check=True
+        )
+        mock_logger.assert_called_with('%s is shaded by %s', 'shaded-term', 'good-term-11')
+
+        mock_logger.reset_mock()
+        other = GOOD_TERM_42
+        policy.ParsePolicy(HEADER + TERM_UNSORTED_ICMP_TYPE + other, self.naming, shade_check=True)
+        mock_logger.assert_not_called()
+
+    def _ParseShadeCheckedExcludeTerm(self, prior_action):
+        prior = """
+term a {
+  protocol:: tcp
+  destination-port:: DNS
+  action:: %s
+}
+""" % prior_action
+        excluded = """
+term b {
+  protocol:: tcp
+  source-address:: NET_A
+  source-exclude:: NET_B
+  destination-port:: SSH
+  action:: accept
+}
+"""
+        self.naming.GetNetAddr.side_effect = lambda name: {
+            'NET_A': [nacaddr.IPv4('10.0.0.0/8')],
+            'NET_B': [nacaddr.IPv4('10.0.0.0/9')],
+        }[name]
+        self.naming.GetServiceByProto.side_effect = lambda name, _: {
+            'DNS': ['53'],
+            'SSH': ['22'],
+        }[name]
+        pol = policy.ParsePolicy(HEADER + prior + excluded, self.naming, shade_check=True)
+        _, terms = pol.filters[0]
+        return terms[1]
+
+    def testShadeCheckFlattensExcludes(self):
+        term = self._ParseShadeCheckedExcludeTerm('accept')
+        self.assertEqual(term.source_address, [nacaddr.IPv4('10.128.0.0/9')])
+
+    def testShadeCheckFlattensExcludesAfterNextTerm(self):
+        term = self._ParseShadeCheckedExcludeTerm('next')
+        self.assertEqual(term.source_address, [nacaddr.IPv4('10.128.0.0/9')])
+
     def testVpnConfigWithoutPairPolicy(self):
         pol = policy.ParsePolicy(HEADER_4 + GOOD_TERM_30, self.naming)
         self.assertEqual(len(pol.filters), 1)
@@ -1213,6 +1385,17 @@ class PolicyTest(parameterized.TestCase):
         self.assertEqual(terms[0].source_tag, ['src-tag'])
         self.assertEqual(terms[0].destination_tag, ['dest-tag'])
 
+    def testHeaderFilterOptionsFirstTargetWins(self):
+        header = policy.Header()
+        header.AddObject(policy.Target(['juniper', 'first', 'inet']))
+        header.AddObject(policy.Target(['srx', 'from-zone', 'trust', 'to-zone', 'untrust']))
+        header.AddObject(policy.Target(['juniper', 'second']))
+        self.assertEqual(header.FilterOptions('juniper'), ['first', 'inet'])
+        self.assertEqual(header.FilterOptions('cisco'), [])
+        self.assertEqual(header.FilterName('juniper'), 'first')
+        self.assertEqual(header.FilterName('srx'), 'trust>untrust')
+        self.assertIsNone(header.FilterName('cisco'))
+
     def testEq(self):
         """Sanity test to verify __eq__ works on Policy objects."""
         policy1 = policy.ParsePolicy(HEADER_4 + GOOD_TERM_30, self.naming)
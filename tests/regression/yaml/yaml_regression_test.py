@@ -448,29 +448,8 @@ class YAMLPolicyTermTest(absltest.TestCase):
                 nacaddr.IPv4('216.239.32.0/19'),
             ],
             [nacaddr.IPv4('10.0.0.0/8')],
-            [nacaddr.IPv4('10.0.0.0/8')],
-            [
-                nacaddr.IPv4('64.233.160.0/19'),
-                nacaddr.IPv4('66.102.0.0/20'),
-                nacaddr.IPv4('66.249.80.0/20'),
-                nacaddr.IPv4('72.14.192.0/18'),
-                nacaddr.IPv4('72.14.224.0/20'),
-                nacaddr.IPv4('216.239.32.0/19'),
-            ],
-            [nacaddr.IPv4('10.0.0.0/8')],
-            [
-                nacaddr.IPv4('64.233.160.0/19'),
-                nacaddr.IPv4('66.102.0.0/20'),
-                nacaddr.IPv4('66.249.80.0/20'),
-                nacaddr.IPv4('72.14.192.0/18'),
-                nacaddr.IPv4('72.14.224.0/20'),
-                nacaddr.IPv4('216.239.32.0/19'),
-            ],
         ]
         self.naming.GetServiceByProto.side_effect = [
-            ['80'],
-            ['3306'],
-            ['3306'],
             ['80'],
             ['3306'],
             ['443'],
@@ -489,26 +468,14 @@ class YAMLPolicyTermTest(absltest.TestCase):
         self.assertNotEqual(terms[0], terms[2])
 
         self.naming.GetNetAddr.assert_has_calls(
-            [
-                mock.call('PROD_EXTERNAL_SUPER'),
-                mock.call('PROD_NETWORK'),
-                mock.call('PROD_NETWORK'),
-                mock.call('PROD_EXTERNAL_SUPER'),
-                mock.call('PROD_NETWORK'),
-                mock.call('PROD_EXTERNAL_SUPER'),
-            ],
-            any_order=True,
+            [mock.call('PROD_EXTERNAL_SUPER'), mock.call('PROD_NETWORK')]
         )
         self.naming.GetServiceByProto.assert_has_calls(
             [
-                mock.call('HTTP', 'tcp'),
-                mock.call('MYSQL', 'tcp'),
-                mock.call('MYSQL', 'tcp'),
                 mock.call('HTTP', 'tcp'),
                 mock.call('MYSQL', 'tcp'),
                 mock.call('HTTPS', 'tcp'),
-            ],
-            any_order=True,
+            ]
         )
 
     @capture.stdout